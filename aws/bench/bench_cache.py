@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compare loading a synthetic account from a cache of raw DescribeInstances
+responses, as find-ec2 used to keep, with loading it from the compact record
+cache, and time a full find-ec2 run served from the latter
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic  # Puts the scripts under test on the path
+
+import find_ec2
+
+
+def best_time(f, repeat):
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def load_raw(path):
+    with open(path, "r") as f:
+        data = json.load(f)
+
+    return sorted(
+        find_ec2.Ec2Instance(i)
+        for r in data["Reservations"] for i in r["Instances"]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--instances", type=int, default=20000)
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+
+    # Point find-ec2, and the copy we run below, at a cache of our own
+    for k in list(os.environ):
+        if k.startswith(("AWS_", "FIND_EC2_")):
+            del os.environ[k]
+    os.environ.update({
+        "XDG_CACHE_HOME": tmp.name,
+        "AWS_REGION": "eu-west-1",
+        "FIND_EC2_SOCKET": os.path.join(tmp.name, "no-daemon.sock")
+    })
+
+    raw = synthetic.instances(args.instances)
+
+    raw_path = os.path.join(tmp.name, "raw.json")
+    with open(raw_path, "w") as f:
+        json.dump(
+            {"Reservations": [{"Instances": raw}]}, f,
+            default=find_ec2.serialise_json
+        )
+
+    finder = find_ec2.Ec2InstanceFinder()
+    finder.cache_dir = os.path.join(tmp.name, "find-ec2")
+    finder.write_cache({
+        "version": find_ec2.CACHE_VERSION,
+        "instances": [find_ec2.Ec2Instance(i).to_record() for i in raw]
+    })
+
+    print(f"{args.instances} instances, best of {args.repeat}")
+
+    raw_time = best_time(lambda: load_raw(raw_path), args.repeat)
+    print(
+        f"raw cache     {os.path.getsize(raw_path) / 1e6:5.1f}MB, "
+        f"load + sort {raw_time:.3f}s"
+    )
+
+    compact_time = best_time(finder.get_all_instances, args.repeat)
+    print(
+        f"compact cache {os.path.getsize(finder.cache_file) / 1e6:5.1f}MB, "
+        f"load + sort {compact_time:.3f}s"
+    )
+
+    run_time = best_time(lambda: subprocess.run(
+        [sys.executable, find_ec2.__file__], stdout=subprocess.DEVNULL,
+        check=True
+    ), args.repeat)
+    print(f"find-ec2 from the compact cache, end to end {run_time:.3f}s")
+
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
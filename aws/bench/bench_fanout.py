@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Compare searching several (profile, region) pairs one at a time with
+Ec2MultiFinder's parallel fan-out, against a fake EC2 client with a fixed
+latency per page
+"""
+
+import argparse
+import itertools
+import time
+
+import synthetic  # Puts the scripts under test on the path
+
+import find_ec2
+
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return time.perf_counter() - start, result
+
+
+def sequential(profiles, regions):
+    instances = []
+
+    for profile, region in itertools.product(profiles, regions):
+        finder = find_ec2.Ec2InstanceFinder(
+            use_cache=False, profile=profile, region=region
+        )
+        instances.extend(finder.iter_instances())
+
+    return sorted(instances)
+
+
+def parallel(profiles, regions):
+    finder = find_ec2.Ec2MultiFinder(
+        profiles=profiles, regions=regions, use_cache=False
+    )
+    return finder.get_all_instances()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--profiles", type=int, default=2)
+    parser.add_argument("--regions", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument(
+        "--latency", type=float, default=0.3,
+        help="Seconds the fake client takes to return each page"
+    )
+    args = parser.parse_args()
+
+    profiles = [f"profile-{i}" for i in range(args.profiles)]
+    regions = [f"region-{i}" for i in range(args.regions)]
+
+    find_ec2.Ec2InstanceFinder.ec2 = synthetic.FakeEc2Client(
+        synthetic.pages(args.pages * args.page_size, args.page_size),
+        latency=args.latency
+    )
+
+    print(
+        f"{len(profiles) * len(regions)} pairs x {args.pages} pages at "
+        f"{args.latency}s per page"
+    )
+
+    for name, search in [("sequential", sequential), ("parallel", parallel)]:
+        elapsed, instances = timed(lambda: search(profiles, regions))
+        print(f"{name : <12} {elapsed:.2f}s, {len(instances)} instances")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Compare printing a large synthetic listing an instance at a time, as
+find-ec2 used to, with Ec2InstanceFormatter's batched write, for each
+output format.
+
+To compare against the formatter from before it was compiled, check out
+find_ec2.py from the commit before that change to somewhere outside the tree,
+and pass it as --baseline, e.g.
+
+    ./bench_format.py --baseline /tmp/find_ec2_baseline.py
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import time
+
+import synthetic  # Puts the scripts under test on the path
+
+import find_ec2
+
+
+def best_time(f, repeat):
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def print_each(formatter, instances):
+    for instance in instances:
+        line = formatter.format(instance)
+        if line:
+            print(line)
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location("find_ec2_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--instances", type=int, default=20000)
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument(
+        "--baseline", metavar="PATH",
+        help="Also time printing with the formatter from this find_ec2.py"
+    )
+    args = parser.parse_args()
+
+    raw = synthetic.instances(args.instances)
+    instances = sorted(find_ec2.Ec2Instance(i) for i in raw)
+    format_key = find_ec2.DEFAULT_FIELDS + [find_ec2.UPTIME]
+
+    baseline = None
+    if args.baseline:
+        baseline = load_module(args.baseline)
+
+        # Older versions only ever saw launch times as strings, from the
+        # JSON cache
+        baseline_raw = json.loads(
+            json.dumps(raw, default=find_ec2.serialise_json)
+        )
+        baseline_instances = sorted(
+            baseline.Ec2Instance(i) for i in baseline_raw
+        )
+
+    print(f"{args.instances} instances, best of {args.repeat}")
+
+    with open(os.devnull, "w") as out:
+        for output_format in [
+            find_ec2.OUTPUT_PRETTY, find_ec2.OUTPUT_CSV, find_ec2.OUTPUT_TSV,
+            find_ec2.OUTPUT_JSONL
+        ]:
+            formatter = find_ec2.Ec2InstanceFormatter(
+                format_key, output_format=output_format
+            )
+
+            with contextlib.redirect_stdout(out):
+                each = best_time(
+                    lambda: print_each(formatter, instances), args.repeat
+                )
+            batched = best_time(
+                lambda: formatter.write(instances, out), args.repeat
+            )
+
+            results = [
+                f"print per instance {each:.3f}s",
+                f"batched write {batched:.3f}s"
+            ]
+
+            if baseline and output_format in (
+                find_ec2.OUTPUT_PRETTY, find_ec2.OUTPUT_CSV
+            ):
+                baseline_formatter = baseline.Ec2InstanceFormatter(
+                    format_key, output_format=output_format
+                )
+                with contextlib.redirect_stdout(out):
+                    before = best_time(
+                        lambda: print_each(
+                            baseline_formatter, baseline_instances
+                        ),
+                        args.repeat
+                    )
+                results.insert(0, f"baseline {before:.3f}s")
+
+            print(f"{output_format : <7} {', '.join(results)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Measure the memory each Ec2Instance keeps alive for a large synthetic
+DescribeInstances response, with and without the raw payload retained.
+
+To compare against Ec2Instance from before it was slotted, check out
+find_ec2.py from the commit before that change to somewhere outside the tree,
+and pass it as --baseline, e.g.
+
+    ./bench_memory.py --baseline /tmp/find_ec2_baseline.py
+"""
+
+import argparse
+import gc
+import importlib.util
+import json
+import tracemalloc
+
+import synthetic  # Puts the scripts under test on the path
+
+import find_ec2
+
+
+def load_module(path):
+    spec = importlib.util.spec_from_file_location("find_ec2_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def retained_per_instance(response, create):
+    """
+    Bytes still allocated per instance once the parsed response itself has
+    been dropped, leaving only what the instances hold on to
+    """
+    gc.collect()
+    tracemalloc.start()
+
+    # Parse inside the trace so every instance owns its own data, as it
+    # would coming from botocore
+    raw = json.loads(response)
+    instances = [create(i) for i in raw]
+    del raw
+    gc.collect()
+
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return retained / len(instances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--instances", type=int, default=20000)
+    parser.add_argument(
+        "--baseline", metavar="PATH",
+        help="Also measure the Ec2Instance from this find_ec2.py"
+    )
+    args = parser.parse_args()
+
+    response = json.dumps(
+        synthetic.instances(args.instances),
+        default=find_ec2.serialise_json
+    )
+
+    print(f"{args.instances} instances, bytes retained per instance:")
+
+    if args.baseline:
+        baseline = load_module(args.baseline)
+        print(
+            "baseline            "
+            f"{retained_per_instance(response, baseline.Ec2Instance):7.0f}"
+        )
+
+    retained = retained_per_instance(
+        response, lambda i: find_ec2.Ec2Instance(i, retain_data=True)
+    )
+    print(f"raw data retained   {retained:7.0f}")
+
+    compact = retained_per_instance(response, find_ec2.Ec2Instance)
+    print(f"compact             {compact:7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Synthetic EC2 data for the benchmarks in this directory, shaped like real
+DescribeInstances responses, including the block devices, network interfaces
+and security groups we never use
+"""
+
+import datetime
+import os
+import sys
+import time
+
+# Make the scripts under test importable, as they import each other
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+LAUNCH_TIME = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+
+def instance_data(i):
+    """A raw instance, as it appears in a DescribeInstances response"""
+    groups = [{"GroupId": f"sg-{g:08x}", "GroupName": f"group-{g}"}
+              for g in range(3)]
+
+    return {
+        "InstanceId": f"i-{i:017x}",
+        "ImageId": "ami-0123456789abcdef0",
+        "InstanceType": "m5.large",
+        "LaunchTime": LAUNCH_TIME,
+        "State": {"Name": "running", "Code": 16},
+        "PrivateIpAddress": f"10.0.{i // 256 % 256}.{i % 256}",
+        "Placement": {"AvailabilityZone": "eu-west-1a", "Tenancy": "default"},
+        "Tags": [
+            {"Key": "Name", "Value": f"host-{i}"},
+            {"Key": "env", "Value": "prod"}
+        ],
+        "BlockDeviceMappings": [
+            {
+                "DeviceName": f"/dev/sd{c}",
+                "Ebs": {
+                    "VolumeId": "vol-0123456789abcdef0",
+                    "Status": "attached",
+                    "AttachTime": LAUNCH_TIME,
+                    "DeleteOnTermination": True
+                }
+            }
+            for c in "abcd"
+        ],
+        "NetworkInterfaces": [
+            {
+                "PrivateIpAddress": f"10.{j + 1}.{i // 256 % 256}.{i % 256}",
+                "MacAddress": "0a:1b:2c:3d:4e:5f",
+                "SubnetId": "subnet-0123456789abcdef0",
+                "Groups": groups,
+                "PrivateIpAddresses": [{
+                    "Primary": True,
+                    "PrivateIpAddress": (
+                        f"10.{j + 1}.{i // 256 % 256}.{i % 256}"
+                    )
+                }]
+            }
+            for j in range(2)
+        ],
+        "SecurityGroups": groups
+    }
+
+
+def instances(count):
+    return [instance_data(i) for i in range(count)]
+
+
+def pages(count, page_size):
+    """DescribeInstances responses covering count instances"""
+    return [
+        {"Reservations": [{
+            "Instances": [
+                instance_data(i)
+                for i in range(start, min(start + page_size, count))
+            ]
+        }]}
+        for start in range(0, count, page_size)
+    ]
+
+
+class FakePaginator:
+    def __init__(self, pages, latency):
+        self.pages = pages
+        self.latency = latency
+
+    def paginate(self, **kwargs):
+        for page in self.pages:
+            time.sleep(self.latency)
+            yield page
+
+
+class FakeEc2Client:
+    """Serves the same pages for every account, latency seconds apiece"""
+    def __init__(self, pages, latency=0):
+        self.pages = pages
+        self.latency = latency
+
+    def get_paginator(self, operation):
+        return FakePaginator(self.pages, self.latency)
@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import itertools
 import logging
 import os
 import shutil
 import subprocess
 import sys
+import threading
 
 import find_ec2
 
@@ -17,42 +20,200 @@ DEFAULT_PS1 = (
 )
 REMOTE_PS1_SCRIPT_PATH = ".ec2-connect/remote-ps1.sh"
 
+# Where to keep SSH ControlMaster sockets, and how long idle masters live
+CONTROL_DIR = os.path.join(os.path.expanduser("~"), ".ec2-connect", "control")
+DEFAULT_CONTROL_PERSIST = "10m"
+
+# How many of the top candidates to pre-connect to with a bare --warm
+DEFAULT_WARM_HOSTS = 5
+
+# How many hosts to run a --cmd on at once in fleet mode
+DEFAULT_FLEET_WORKERS = 10
+
+# How many matches the fallback selector lists at a time
+FALLBACK_PAGE_SIZE = 20
+
 
 # TODO: Move to a lib
-def fzf(options, write_option, prompt="Select: ", multi=False):
+def fzf(options, write_option, prompt="Select: ", multi=False, fzf_exec=None):
     """
-    Use fzf to filter options down. Options may be a list of any type of
-    object, and write_option will be used to write them as a string. Options
-    must produce unique strings so that the original objects can be matched
-    back once fzf has selected them.
+    Use fzf to filter options down. Options may be any iterable of any type of
+    object, including a lazy one, and write_option will be used to write them
+    as a string.
+
+    Options are written to fzf from a background thread as they're produced,
+    so the user can start choosing before they've all arrived. Each line is
+    tagged with a hidden index which is used to map selections back to the
+    original objects, so options needn't produce unique strings.
     """
-    if not options:
-        raise Exception("No options provided to fzf")
-
-    fzf_exec = shutil.which("fzf")
+    fzf_exec = fzf_exec or shutil.which("fzf")
 
     if not fzf_exec:
         raise Exception("Please install fzf to use this script")
 
-    values = OrderedDict([(write_option(o), o) for o in options])
-    if len(values) != len(options):
-        raise ValueError(
-            "Some options passed to fzf produced colliding strings!"
+    multi_flag = "-m" if multi else "+m"
+    cmd = [
+        fzf_exec, "--ansi", "-i", "-0", "--prompt", prompt, multi_flag,
+        "--delimiter", "\t", "--with-nth", "2.."
+    ]
+
+    proc = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        bufsize=1
+    )
+    written = []
+    errors = []
+
+    def _feed():
+        try:
+            for i, option in enumerate(options):
+                written.append(option)
+                proc.stdin.write(f"{i}\t{write_option(option)}\n")
+        except BrokenPipeError:
+            # fzf has already finished; stop producing options
+            pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=_feed, daemon=True)
+    feeder.start()
+
+    stdout = proc.stdout.read()
+    returncode = proc.wait()
+
+    if errors:
+        raise errors[0]
+
+    if returncode != 0:
+        raise ValueError(f"fzf exited with return code {returncode}")
+
+    return [
+        written[int(line.split("\t", 1)[0])]
+        for line in stdout.split("\n") if line
+    ]
+
+
+def _rank_lines(query, candidates):
+    """
+    Order (option, line) candidates by how well their lines fuzzy-match every
+    term of the query, best first, dropping any which don't match
+    """
+    terms = query.lower().split()
+    if not terms:
+        return candidates
+
+    ranked = []
+    for option, line in candidates:
+        lowered = line.lower()
+        scores = [find_ec2.fuzzy_score(term, lowered) for term in terms]
+        if None not in scores:
+            ranked.append((sum(scores), option, line))
+
+    ranked.sort(key=lambda r: -r[0])
+    return [(option, line) for _, option, line in ranked]
+
+
+def _parse_picks(reply, shown, multi):
+    """
+    Interpret a reply as a choice of listed matches by number, or return None
+    if it should be treated as a new query instead
+    """
+    tokens = reply.replace(",", " ").split()
+    if not tokens or not all(t.isdigit() for t in tokens):
+        return None
+
+    picks = [int(t) for t in tokens]
+    if any(n < 1 or n > len(shown) for n in picks):
+        return None
+
+    if not multi and len(picks) > 1:
+        return None
+
+    return [shown[n - 1][0] for n in picks]
+
+
+def select_fallback(options, write_option, prompt="Select: ", multi=False):
+    """
+    A crude, line-based stand-in for fzf when it isn't installed. We list the
+    best matches for a query and let the user refine it until they pick one
+    or more by number. Options are consumed in a background thread so the
+    first of them can be browsed while the rest are still arriving.
+    """
+    lock = threading.Lock()
+    loaded = []
+    errors = []
+    done = threading.Event()
+
+    def _load():
+        try:
+            for option in options:
+                line = write_option(option)
+                with lock:
+                    loaded.append((option, line))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    threading.Thread(target=_load, daemon=True).start()
+
+    query = ""
+    while True:
+        if errors:
+            raise errors[0]
+
+        with lock:
+            candidates = list(loaded)
+
+        matches = _rank_lines(query, candidates)
+        shown = matches[:FALLBACK_PAGE_SIZE]
+
+        for n, (_, line) in enumerate(shown, 1):
+            print(f"{n : >3}) {line}", file=sys.stderr)
+
+        loading = "" if done.is_set() else ", still loading"
+        several = " (several allowed)" if multi else ""
+        print(
+            f"  {len(matches)}/{len(candidates)} matching{loading}. Type to "
+            f"filter, or pick by number{several}",
+            file=sys.stderr
         )
+        print(prompt, end="", file=sys.stderr, flush=True)
 
-    multi_flag = "-m" if multi else "+m"
-    cmd = [fzf_exec, "--ansi", "-i", "-0", "--prompt", prompt, multi_flag]
+        reply = sys.stdin.readline()
+        if not reply:
+            raise ValueError("No selection made")
 
-    result = subprocess.run(
-        cmd, input="\n".join(values.keys()), text=True, stdout=subprocess.PIPE
-    )
-    if result.returncode != 0:
-        if result.stderr:
-            logging.error(result.stderr)
-        raise ValueError(f"fzf exited with return code {result.returncode}")
+        reply = reply.strip()
+        if not reply and len(matches) == 1:
+            return [matches[0][0]]
+
+        picks = _parse_picks(reply, shown, multi)
+        if picks is not None:
+            return picks
 
-    lines = result.stdout.split("\n")
-    return [values[line] for line in lines if line]
+        if reply:
+            query = reply
+
+
+def select(options, write_option, prompt="Select: ", multi=False):
+    """
+    Choose among options with fzf, or a pure-python fallback if it isn't
+    available. See fzf for details.
+    """
+    fzf_exec = shutil.which("fzf")
+    if fzf_exec:
+        return fzf(
+            options, write_option, prompt=prompt, multi=multi,
+            fzf_exec=fzf_exec
+        )
+
+    return select_fallback(options, write_option, prompt=prompt, multi=multi)
 
 
 def _notice(msg, *args, **kwargs):
@@ -60,13 +221,59 @@ def _notice(msg, *args, **kwargs):
 
 
 class Ec2Connect:
-    """Handle connecting to an instance via SSH / SCP"""
-    def __init__(self, host, user, key, command=None, scp=False):
+    """
+    Handle connecting to an instance via SSH / SCP.
+
+    Unless multiplexing is disabled, connections go through a ControlMaster
+    per host which outlives us for a while, so repeat connections and
+    commands skip the SSH handshake entirely.
+    """
+    def __init__(
+        self, host, user, key, command=None, scp=False, multiplex=True,
+        control_persist=DEFAULT_CONTROL_PERSIST
+    ):
         self.host = host
         self.user = user
         self.key = key
         self.command = command
         self.scp = scp
+        self.multiplex = multiplex
+        self.control_persist = control_persist
+
+    def ssh_options(self):
+        if not self.multiplex:
+            return []
+
+        os.makedirs(CONTROL_DIR, mode=0o700, exist_ok=True)
+        return [
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={CONTROL_DIR}/%C",
+            "-o", f"ControlPersist={self.control_persist}"
+        ]
+
+    def warm(self, host):
+        """
+        Open a master connection to host in the background, without waiting
+        for it, so that a later connection can reuse it. Anything which would
+        need user input just fails, as we may be sharing the terminal with fzf.
+        """
+        if not self.multiplex or self.scp or not host:
+            return
+
+        cmd = [
+            "ssh", "-f", "-N",
+            "-o", "BatchMode=yes",
+            "-o", "ConnectTimeout=10",
+            *self.ssh_options(),
+            "-i", self.key, f"{self.user}@{host}"
+        ]
+        subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
 
     def _get_ps1(self, instance_name):
         """
@@ -88,27 +295,38 @@ class Ec2Connect:
         """
         Unless given a specific command to run, we do some clever juggling
         of a custom bashrc, use it to set a prettier PS1, and then start bash
-        with that new --rcfile
+        with that new --rcfile.
+
+        The custom bashrc is named after its PS1 and only rebuilt if missing
+        or older than ~/.bashrc, so repeat connections don't rewrite it.
         """
         if self.command:
             return self.command
 
         ps1 = self._get_ps1(instance_name)
+        ps1_hash = hashlib.md5(ps1.encode()).hexdigest()[:12]
+        rcfile = f"~/.bashrc.ec2-connect-{ps1_hash}"
+
         return (
-            "cp ~/.bashrc ~/.bashrc.n && "
-            f"echo 'export PS1=\"{ps1}\"' >> ~/.bashrc.n; "
-            "bash --rcfile ~/.bashrc.n"
+            f"[ {rcfile} -nt ~/.bashrc ] || {{ cp ~/.bashrc {rcfile} && "
+            f"echo 'export PS1=\"{ps1}\"' >> {rcfile}; }}; "
+            f"bash --rcfile {rcfile}"
         )
 
     def print_scp(self, host):
         print(f"scp -i '{self.key}' $LOCAL_FILE {self.user}@{host}:~")
 
+    def ssh_command(self, host, launch_cmd, *extra_opts):
+        return [
+            "ssh", *extra_opts, *self.ssh_options(),
+            "-i", self.key, f"{self.user}@{host}", launch_cmd
+        ]
+
     def ssh(self, host, instance_name):
         _notice("Connecting to instance %s (%s)", instance_name, host)
         launch_cmd = self.get_command(instance_name)
 
-        cmd = ["ssh", "-t", "-i", self.key, f"{self.user}@{host}", launch_cmd]
-        subprocess.run(cmd)
+        subprocess.run(self.ssh_command(host, launch_cmd, "-t"))
 
     def connect(self, host, instance_name):
         if self.scp:
@@ -117,17 +335,126 @@ class Ec2Connect:
         return self.ssh(host, instance_name)
 
 
+class Ec2FleetCommand:
+    """
+    Run a connection's --cmd on many hosts at once, on a bounded pool of
+    workers, streaming each line of output prefixed with the instance it came
+    from, and summarising exit statuses at the end
+    """
+    def __init__(self, connect, workers=DEFAULT_FLEET_WORKERS, timeout=None):
+        if not connect.command:
+            raise ValueError("Running on multiple hosts requires --cmd")
+
+        self.connect = connect
+        self.workers = workers
+        self.timeout = timeout
+        self.print_lock = threading.Lock()
+
+    def run_one(self, host, instance_name, prefix_width):
+        """
+        Run the command on one host, killing it if it overruns the timeout
+
+        :returns: The exit status, or None if it timed out
+        """
+        prefix = f"\033[36m{instance_name : <{prefix_width}}\033[0m |"
+        cmd = self.connect.ssh_command(
+            host, self.connect.command, "-o", "BatchMode=yes"
+        )
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace"
+        )
+
+        timed_out = threading.Event()
+
+        def _kill():
+            timed_out.set()
+            proc.kill()
+
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, _kill)
+            timer.start()
+
+        try:
+            for line in proc.stdout:
+                with self.print_lock:
+                    print(prefix, line, end="", flush=True)
+
+            returncode = proc.wait()
+        finally:
+            if timer:
+                timer.cancel()
+
+        return None if timed_out.is_set() else returncode
+
+    def summarise(self, results):
+        """Log a summary of how each host got on, returning our exit code"""
+        succeeded = [name for name, status in results if status == 0]
+        timed_out = [name for name, status in results if status is None]
+        failed = [
+            f"{name} ({status})" for name, status in results
+            if status not in (0, None)
+        ]
+
+        _notice(
+            "%d succeeded, %d failed, %d timed out",
+            len(succeeded), len(failed), len(timed_out)
+        )
+        if failed:
+            logger.error("Failed: %s", ", ".join(failed))
+        if timed_out:
+            logger.error("Timed out: %s", ", ".join(timed_out))
+
+        return 0 if len(succeeded) == len(results) else 1
+
+    def run(self, targets):
+        """
+        :param targets: List of (host, instance_name) tuples
+        :returns: 0 if the command succeeded everywhere, otherwise 1
+        """
+        width = max(len(name) for _, name in targets)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [
+                (name, pool.submit(self.run_one, host, name, width))
+                for host, name in targets
+            ]
+            results = [(name, future.result()) for name, future in futures]
+
+        return self.summarise(results)
+
+
 class Ec2ConnectTask:
     """
     The overall task of finding and filtering instances and then attempting to
     connect to one
     """
-    def __init__(self, connect, finder, formatter, filter, ip_type):
+    def __init__(
+        self, connect, finder, formatter, filter, ip_type, warm=0, fleet=None,
+        select_all=False, yes=False, stream=False
+    ):
         self.connect = connect
         self.finder = finder
         self.formatter = formatter
         self.filter = filter
         self.ip_type = ip_type or find_ec2.IP_PRIVATE
+        self.warm = warm
+
+        # If given an Ec2FleetCommand, run on every host picked rather than
+        # connecting to just one, picking all matches if select_all is set.
+        # That only asks for confirmation, unless yes is set too.
+        self.fleet = fleet
+        self.select_all = select_all
+        self.yes = yes
+
+        # Offer instances for selection as they're fetched, unranked, rather
+        # than waiting for the full list
+        self.stream = stream
 
     def select_instance_ip(self):
         """
@@ -140,30 +467,93 @@ class Ec2ConnectTask:
 
         :returns: Tuple (instance, ip_address)
         """
-        instances = self.filter.apply(self.finder.get_all_instances())
-        options = [
+        return self.select_instance_ips(multi=False)[0]
+
+    def select_instance_ips(self, multi=True):
+        """
+        As select_instance_ip, but allowing several choices in fzf
+
+        :returns: List of (instance, ip_address) tuples
+        """
+        if self.stream:
+            instances = self.filter.stream(self.finder.iter_instances())
+        else:
+            instances = self.filter.apply(self.finder.get_all_instances())
+
+        options = (
             (instance, ip)
             for instance in instances
             for ip in instance.get_ips_by_type(self.ip_type)
-        ]
+        )
 
-        if not options:
+        # Look ahead just far enough to tell if there's anything to choose
+        first = list(itertools.islice(options, 2))
+
+        if not first:
             raise ValueError("No results")
 
-        if len(options) == 1:
-            return options[0]
+        options = itertools.chain(first, options)
 
-        return fzf(
-            options=options,
+        if self.select_all:
+            return self._confirmed(list(options))
+
+        if len(first) == 1:
+            return first
+
+        return select(
+            options=self._warming(options),
             write_option=lambda o: self.formatter.format_line(o[0], o[1]),
-            prompt="Select host: ",
-            multi=False
-        )[0]
+            prompt="Select hosts: " if multi else "Select host: ",
+            multi=multi
+        )
+
+    def _confirmed(self, options):
+        """List every host --all would run on, and check that's intended"""
+        if self.yes:
+            return options
+
+        for instance, ip in options:
+            print(self.formatter.format_line(instance, ip), file=sys.stderr)
+
+        print(
+            f"Run on these {len(options)} hosts? [y/N] ", end="",
+            file=sys.stderr, flush=True
+        )
+        if sys.stdin.readline().strip().lower() not in ("y", "yes"):
+            raise ValueError("Cancelled; pass --yes to run without asking")
+
+        return options
+
+    def _warming(self, options):
+        """
+        Pass options through, warming up connections to the first few. Unless
+        streaming, these are the likeliest picks as they're ranked best match
+        first, so we can start handshaking while the user makes up their mind.
+        """
+        for n, (instance, ip) in enumerate(options):
+            if n < self.warm:
+                self.connect.warm(ip)
+
+            yield instance, ip
+
+    def run_fleet(self):
+        targets = [
+            (ip, instance.name or instance.instance_id)
+            for instance, ip in self.select_instance_ips(multi=True)
+            if ip
+        ]
+        if not targets:
+            raise ValueError("Can't connect to hosts with no IP available")
+
+        return self.fleet.run(targets)
 
     def run(self, override_host=None):
         host = None
         instance_name = None
 
+        if self.fleet and not override_host:
+            return self.run_fleet()
+
         if override_host:
             host = override_host
             instance_name = f"host:{host}"
@@ -205,6 +595,55 @@ def main():
     conn_parser.add_argument(
         "--cmd", help="Run the provided command instead of a bash shell"
     )
+    conn_parser.add_argument(
+        "--no-multiplex", action="store_false", dest="multiplex", help=(
+            "Don't share SSH connections to a host via a ControlMaster"
+        )
+    )
+    conn_parser.add_argument(
+        "--control-persist", default=DEFAULT_CONTROL_PERSIST, help=(
+            "How long idle master connections stay open, in ssh_config "
+            f"ControlPersist format. Default is {DEFAULT_CONTROL_PERSIST}"
+        )
+    )
+    conn_parser.add_argument(
+        "--warm", type=int, nargs="?", const=DEFAULT_WARM_HOSTS, default=0,
+        help=(
+            "Open master connections to the top N candidates in the "
+            "background while choosing between them in fzf. Default N is "
+            f"{DEFAULT_WARM_HOSTS}"
+        )
+    )
+
+    fleet_parser = parser.add_argument_group("fleet")
+    fleet_parser.add_argument(
+        "-m", "--multi", action="store_true", help=(
+            "Select several hosts in fzf and run --cmd on all of them at once"
+        )
+    )
+    fleet_parser.add_argument(
+        "--all", action="store_true", dest="select_all", help=(
+            "Run --cmd on every matching host at once, after listing them "
+            "for confirmation"
+        )
+    )
+    fleet_parser.add_argument(
+        "-y", "--yes", action="store_true", help=(
+            "Don't ask for confirmation with --all"
+        )
+    )
+    fleet_parser.add_argument(
+        "--parallel", type=int, default=DEFAULT_FLEET_WORKERS, help=(
+            "Maximum number of hosts to run on at once with --multi or "
+            f"--all. Default is {DEFAULT_FLEET_WORKERS}"
+        )
+    )
+    fleet_parser.add_argument(
+        "--timeout", type=float, default=None, help=(
+            "Give up on a host if --cmd hasn't finished after this many "
+            "seconds"
+        )
+    )
 
     args = parser.parse_args()
 
@@ -213,13 +652,25 @@ def main():
 
     connect = Ec2Connect(
         host=args.host, user=args.user, key=args.key, command=args.cmd,
-        scp=args.scp
+        scp=args.scp, multiplex=args.multiplex,
+        control_persist=args.control_persist
     )
-    finder, formatter, filter = find_ec2.create_components(args)
-    task = Ec2ConnectTask(connect, finder, formatter, filter, args.ip_type)
 
     try:
-        task.run(override_host=args.host)
+        fleet = None
+        if args.multi or args.select_all:
+            fleet = Ec2FleetCommand(
+                connect, workers=args.parallel, timeout=args.timeout
+            )
+
+        finder, formatter, filter = find_ec2.create_components(args)
+        task = Ec2ConnectTask(
+            connect, finder, formatter, filter, args.ip_type, warm=args.warm,
+            fleet=fleet, select_all=args.select_all, yes=args.yes,
+            stream=args.stream
+        )
+
+        sys.exit(task.run(override_host=args.host))
     except ValueError as e:
         logging.error(str(e))
         sys.exit(1)
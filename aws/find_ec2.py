@@ -1,15 +1,31 @@
 #!/usr/bin/python3
 
 import argparse
+import configparser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
+import fnmatch
+import glob
+import hashlib
+import itertools
 import json
+import logging
 import math
 import os
+import re
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
 from typing import Optional
 
-import boto3
-from botocore import session as core_session
-from botocore.credentials import JSONFileCache
+# N.B. boto3 and botocore are imported only once we actually need to talk to
+# AWS, since importing them dwarfs everything else on the cached path
+
+logger = logging.getLogger(__name__)
 
 # Internal enum for which IPs to present
 IP_PUBLIC = "public_ip"
@@ -24,6 +40,16 @@ STATE_TERMINATED = 48
 STATE_STOPPING = 64
 STATE_STOPPED = 80
 
+# EC2 instance state names, as accepted by --state
+STATE_NAMES = [
+    "pending",
+    "running",
+    "shutting-down",
+    "terminated",
+    "stopping",
+    "stopped"
+]
+
 # Icons to express state in few characters
 STATE_ICONS = {
     STATE_PENDING: "⌛",
@@ -38,21 +64,25 @@ STATE_ICONS = {
 INSTANCE_ID = "instance_id"
 IP = "ip"
 NAME = "name"
+PROFILE = "profile"
+REGION = "region"
 UPTIME = "uptime"
 
 DEFAULT_FIELDS = [NAME, IP, INSTANCE_ID]
-ALL_FORMAT_FIELDS = [INSTANCE_ID, IP, NAME, UPTIME]
+ALL_FORMAT_FIELDS = [INSTANCE_ID, IP, NAME, PROFILE, REGION, UPTIME]
 
 # Approx. expected lengths of fields for pretty printing with printf
 PRETTY_LENGTHS = {
     INSTANCE_ID: 21,
     IP: 15,
     NAME: 34,
+    PROFILE: 16,
+    REGION: 14,
     UPTIME: 7
 }
 
 # Mark fields missing like (no name) if absent
-MARK_ABSENT_FIELDS = {NAME}
+MARK_ABSENT_FIELDS = {NAME, PROFILE, REGION}
 
 # Replace with an empty string if absent
 OMIT_ABSENT_FIELDS = {IP}
@@ -60,6 +90,78 @@ OMIT_ABSENT_FIELDS = {IP}
 # Potential output formats enum
 OUTPUT_PRETTY = "pretty"
 OUTPUT_CSV = "csv"
+OUTPUT_TSV = "tsv"
+OUTPUT_JSONL = "jsonl"
+
+# How many output lines to buffer up between writes
+WRITE_BATCH_SIZE = 1000
+
+# Kinds of change reported by --diff and --watch, and how to mark them
+CHANGE_LAUNCHED = "launched"
+CHANGE_REMOVED = "removed"
+CHANGE_STATE = "state"
+CHANGE_IP = "ip"
+
+CHANGE_MARKERS = {
+    CHANGE_LAUNCHED: "+",
+    CHANGE_REMOVED: "-",
+    CHANGE_STATE: "~",
+    CHANGE_IP: "~"
+}
+
+# Polling intervals for --watch, in seconds. We back off exponentially up to
+# the max while nothing is changing, and drop back as soon as something does
+DEFAULT_WATCH_INTERVAL = 15
+MAX_WATCH_INTERVAL = 5 * 60
+
+# Upper bound on concurrent describe_instances calls when fanning out
+MAX_FETCH_WORKERS = 16
+
+# Cache lifetimes, in seconds. Results younger than the TTL are served as-is;
+# older results are still served, but trigger a background refresh, until
+# they pass the max staleness, at which point we block on a fresh fetch.
+# Cache files untouched for longer than the eviction age are deleted.
+DEFAULT_CACHE_TTL = int(os.environ.get("FIND_EC2_CACHE_TTL", 600))
+CACHE_MAX_STALE = 24 * 60 * 60
+CACHE_EVICT_AGE = 7 * 24 * 60 * 60
+
+# A refresh lock older than this is assumed to belong to a dead refresher
+CACHE_LOCK_TIMEOUT = 5 * 60
+
+CACHE_PREFIX = "find-ec2-results-"
+
+# Per-user, so nobody else can read our results or trip over our files
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "find-ec2"
+)
+
+# Bump whenever Ec2Instance.to_record changes shape; older caches are ignored
+CACHE_VERSION = 2
+
+# fzf-style fuzzy match scoring
+SCORE_MATCH = 16
+SCORE_GAP_START = -3
+SCORE_GAP_EXTENSION = -1
+BONUS_BOUNDARY = 8
+BONUS_CONSECUTIVE = 4
+BONUS_FIRST_CHAR_MULTIPLIER = 2
+
+# Where find_ec2_daemon.py listens, if it's running. This must be somewhere
+# other users can't write to, or they could serve us instances of their own.
+DAEMON_SOCKET = os.environ.get("FIND_EC2_SOCKET") or os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or CACHE_DIR, "find-ec2.sock"
+)
+
+# Generous, as the daemon may have to do a cold fetch for new targets
+DAEMON_TIMEOUT = 60
+
+TAG_TERM_PREFIX = "tag:"
+INSTANCE_ID_TERM_PATTERN = re.compile(r"^i-[0-9a-f]+$")
+
+
+def _split_csv(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
 
 
 def get_argument_parser(name="find_ec2"):
@@ -76,11 +178,64 @@ def get_argument_parser(name="find_ec2"):
         "-C", "--no-cache", action="store_false", dest="use_cache",
         help="Skip the cache"
     )
+    parser.add_argument(
+        "--cache-ttl", type=int, default=DEFAULT_CACHE_TTL, help=(
+            "Seconds before cached results are refreshed in the background. "
+            f"Default is {DEFAULT_CACHE_TTL}, or $FIND_EC2_CACHE_TTL"
+        )
+    )
+    parser.add_argument(
+        "--refresh", action="store_true", help=(
+            "Refresh the cache in the background, serving any existing "
+            "cached results in the meantime"
+        )
+    )
+    parser.add_argument(
+        "--refresh-only", action="store_true", help=argparse.SUPPRESS
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_false", dest="use_daemon", help=(
+            "Don't query find_ec2_daemon.py even if it's running. The daemon "
+            "is also skipped with -C"
+        )
+    )
+    parser.add_argument(
+        "-s", "--stream", action="store_true", help=(
+            "Print instances as each page of results arrives instead of "
+            "waiting to sort the full listing"
+        )
+    )
+    parser.add_argument(
+        "--profiles", type=_split_csv, default=None, help=(
+            "Search each of these comma-separated AWS profiles in parallel "
+            "instead of the one implied by the environment"
+        )
+    )
+    parser.add_argument(
+        "--regions", type=_split_csv, default=None, help=(
+            "Search each of these comma-separated regions in parallel "
+            "instead of the one implied by the environment"
+        )
+    )
     parser.add_argument(
         "pattern", nargs="?", help=(
             "Filter instances by this term before presenting choices. If "
             "there is exactly one match for the term it will be picked "
-            "automatically."
+            "automatically. Space-separated terms must all match; plain "
+            "terms are fuzzy-matched against names, instance IDs, IPs and "
+            "tag values, while tag:KEY=VALUE (VALUE may contain * "
+            "wildcards) matches a specific tag. Terms which look like an "
+            "instance ID prefix (i-0abc) only match instance IDs, and terms "
+            "containing * are matched as a glob against the Name tag. "
+            "Results are ranked by how well they match. Where possible, "
+            "terms are also passed to EC2 as filters to cut down on what "
+            "we fetch."
+        )
+    )
+    parser.add_argument(
+        "--state", dest="states", type=_split_csv, default=None, help=(
+            "Only include instances in these comma-separated states: "
+            f"{','.join(STATE_NAMES)}"
         )
     )
 
@@ -98,6 +253,17 @@ def get_argument_parser(name="find_ec2"):
         "--csv", dest="output_format", nargs="?", const=OUTPUT_CSV,
         help="Output data as CSV instead of pretty-printing"
     )
+    format_parser.add_argument(
+        "--tsv", dest="output_format", action="store_const", const=OUTPUT_TSV,
+        help="Output data as tab-separated values instead of pretty-printing"
+    )
+    format_parser.add_argument(
+        "--jsonl", dest="output_format", action="store_const",
+        const=OUTPUT_JSONL, help=(
+            "Output data as JSON lines, one object per line keyed by the "
+            "format key. Absent fields are null and uptime is in seconds"
+        )
+    )
     format_parser.add_argument(
         "--public-ip", action="store_const", dest="ip_type", const=IP_PUBLIC,
         help="Use public IP instead of private"
@@ -119,6 +285,42 @@ def get_argument_parser(name="find_ec2"):
     return parser
 
 
+def write_json_atomic(path, data):
+    """
+    Write to a temp file and rename it into place so that concurrent readers
+    never see a partially-written file
+    """
+    dirname, basename = os.path.split(path)
+    os.makedirs(dirname, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=f".{basename}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, default=serialise_json, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_json(path):
+    """Read a JSON file, or None if it's missing, unreadable or corrupt"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_own_socket(path) -> bool:
+    """Whether path is a unix socket belonging to the current user"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
 def serialise_json(obj: any) -> str:
     """Serialiser for non-serialisable types"""
     if isinstance(obj, datetime.datetime):
@@ -128,23 +330,118 @@ def serialise_json(obj: any) -> str:
 
 
 class Ec2Instance:
-    def __init__(self, data):
-        self.data = data
+    """
+    The fields we care about from one instance in a DescribeInstances
+    response. The raw response is dropped unless retain_data is set, as it's
+    many times the size of what we keep, and slots keep the rest compact.
+    """
+    __slots__ = (
+        "data",
+        "profile",
+        "region",
+        "tags",
+        "name",
+        "instance_id",
+        "_launch_time",
+        "state",
+        "state_code",
+        "private_ip",
+        "public_ip",
+        "_interface_ips",
+        "sort_key"
+    )
+
+    def __init__(self, data, profile=None, region=None, retain_data=False):
+        self.data = data if retain_data else None
 
-        self.name = None
+        # Where the instance was found, when searching several accounts or
+        # regions at once
+        self.profile = profile
+        self.region = region
 
-        tags = data.get("Tags", [])
-        for t in tags:
-            if t["Key"] == "Name":
-                self.name = t["Value"]
+        self.tags = {t["Key"]: t["Value"] for t in data.get("Tags", [])}
+        self.name = self.tags.get("Name")
 
         self.instance_id = data["InstanceId"]
-        self.launch_time = datetime.datetime.fromisoformat(data["LaunchTime"])
+        self._launch_time = data["LaunchTime"]
         self.state = data["State"]["Name"]
         self.state_code = data["State"]["Code"]
         self.private_ip = data.get("PrivateIpAddress")
         self.public_ip = data.get("PublicIpAddress")
 
+        self._interface_ips = [
+            i["PrivateIpAddress"] for i in data.get("NetworkInterfaces", [])
+            if i.get("PrivateIpAddress") is not None
+        ]
+        self.sort_key = self._sort_key()
+
+    @classmethod
+    def from_record(cls, record, profile=None, region=None):
+        """
+        Rehydrate an instance from a compact cache record (see to_record).
+        Launch time and interface IPs are left in their serialised form and
+        only parsed if they're actually used.
+        """
+        instance = cls.__new__(cls)
+        instance.data = None
+        instance.profile = profile
+        instance.region = region
+
+        (
+            instance.instance_id,
+            instance._launch_time,
+            instance.state,
+            instance.state_code,
+            instance.private_ip,
+            instance.public_ip,
+            instance._interface_ips,
+            instance.tags
+        ) = record
+        instance.name = instance.tags.get("Name")
+        instance.sort_key = instance._sort_key()
+
+        return instance
+
+    def _sort_key(self):
+        return (self.name or "", self.private_ip or "", self.instance_id)
+
+    def to_record(self):
+        """Project the fields we use into a compact, JSON-friendly row"""
+        launch_time = self._launch_time
+        if isinstance(launch_time, datetime.datetime):
+            launch_time = launch_time.isoformat()
+
+        return [
+            self.instance_id,
+            launch_time,
+            self.state,
+            self.state_code,
+            self.private_ip,
+            self.public_ip,
+            ",".join(self.interface_ips),
+            self.tags
+        ]
+
+    @property
+    def launch_time(self):
+        # Fresh API responses carry datetimes; cached ones carry ISO strings
+        if isinstance(self._launch_time, str):
+            self._launch_time = datetime.datetime.fromisoformat(
+                self._launch_time
+            )
+
+        return self._launch_time
+
+    @property
+    def interface_ips(self):
+        """Private IPs of all network interfaces, parsed on first use"""
+        if isinstance(self._interface_ips, str):
+            self._interface_ips = (
+                self._interface_ips.split(",") if self._interface_ips else []
+            )
+
+        return self._interface_ips
+
     def get_ips_by_type(self, ip_type):
         if ip_type == IP_PRIVATE:
             return [self.private_ip]
@@ -159,34 +456,23 @@ class Ec2Instance:
 
     @property
     def alternate_ips(self):
-        ips = []
-
-        interfaces = self.data.get("NetworkInterfaces", [])
-        for interface in interfaces:
-            ip = interface.get("PrivateIpAddress")
-
-            if ip is not None and ip != self.private_ip:
-                ips.append(ip)
-
-        return ips
+        return [ip for ip in self.interface_ips if ip != self.private_ip]
 
     @property
     def uptime(self):
-        now = datetime.datetime.now(datetime.UTC)
-        launch_time = self.launch_time
+        return self.uptime_at(datetime.datetime.now(datetime.UTC))
 
-        return (now - launch_time).total_seconds()
+    def uptime_at(self, now):
+        return (now - self.launch_time).total_seconds()
 
     def __str__(self):
         return f"{self.name}\t{self.private_ip}\t{self.instance_id}"
 
-    def __gt__(self, other):
-        my_key = [self.name or "", self.private_ip or "", self.instance_id]
-        other_key = [
-            other.name or "", other.private_ip or "", other.instance_id
-        ]
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
 
-        return my_key > other_key
+    def __gt__(self, other):
+        return self.sort_key > other.sort_key
 
 
 class Ec2InstanceFormatter:
@@ -204,23 +490,62 @@ class Ec2InstanceFormatter:
                     f"'{field}' is not a valid option for format key"
                 )
 
-    def format_field(self, key, instance, value=None):
-        """Prettify different fields in different ways based on key"""
-        value = value or getattr(instance, key, None)
-
-        if key in MARK_ABSENT_FIELDS:
-            return value or f"(no {key})"
+        self.render = self.compile()
 
-        if key in OMIT_ABSENT_FIELDS:
-            return value or ""
+    def field_getter(self, key):
+        """
+        Get a function (instance, ip, now) -> value which prettifies the
+        field for key in the appropriate way
+        """
+        if key == IP:
+            return lambda instance, ip, now: ip or (
+                None if self.output_format == OUTPUT_JSONL else ""
+            )
 
         if key == UPTIME:
-            return self.format_uptime(instance)
+            if self.output_format == OUTPUT_JSONL:
+                return lambda instance, ip, now: int(instance.uptime_at(now))
+
+            return lambda instance, ip, now: self.format_uptime(instance, now)
+
+        if key in MARK_ABSENT_FIELDS and self.output_format != OUTPUT_JSONL:
+            absent = f"(no {key})"
+            return lambda instance, ip, now: getattr(instance, key) or absent
+
+        return lambda instance, ip, now: getattr(instance, key)
 
-        return value
+    def compile(self):
+        """
+        Build a function (instance, ip, now) -> line for the format key and
+        output format, so that the per-line work is just one call per field
+        """
+        getters = [self.field_getter(key) for key in self.format_key]
+
+        if self.output_format == OUTPUT_JSONL:
+            keys = list(self.format_key)
+            encode = json.JSONEncoder(ensure_ascii=False).encode
+
+            return lambda instance, ip, now: encode(dict(zip(
+                keys, [g(instance, ip, now) for g in getters]
+            )))
+
+        # Pad to a given width if we're creating human-readable output
+        if self.output_format == OUTPUT_PRETTY:
+            template = " ".join(
+                f"{{: <{PRETTY_LENGTHS.get(key, 1)}}}"
+                for key in self.format_key
+            )
+            return lambda instance, ip, now: template.format(
+                *[g(instance, ip, now) for g in getters]
+            )
+
+        sep = "\t" if self.output_format == OUTPUT_TSV else ","
+        return lambda instance, ip, now: sep.join(
+            [g(instance, ip, now) for g in getters]
+        )
 
-    def format_uptime(self, instance):
-        uptime = instance.uptime
+    def format_uptime(self, instance, now=None):
+        uptime = instance.uptime_at(now) if now else instance.uptime
         units = "s"
 
         thresholds = [("m", 60), ("h", 60), ("d", 24)]
@@ -238,7 +563,7 @@ class Ec2InstanceFormatter:
 
         return f"{pretty_state} {pretty_uptime}"
 
-    def format_line(self, instance, ip):
+    def format_line(self, instance, ip, now=None):
         """
         One line of output format, specifying an IP to display along with the
         instance. With --alt-ip, Where an
@@ -247,28 +572,16 @@ class Ec2InstanceFormatter:
 
         In cases, IP may be expected to be absent for some entries.
         """
-        line = []
-        sep = "," if self.output_format == OUTPUT_CSV else " "
-
-        for key in self.format_key:
-            formatted = self.format_field(
-                key, instance, value=ip if key == IP else None
-            )
-
-            # Pad to a given width if we're creating human-readable output
-            if self.output_format == OUTPUT_PRETTY:
-                len = PRETTY_LENGTHS.get(key, 1)
-                line.append(f"{formatted : <{len}}")
-            else:
-                line.append(formatted)
+        return self.render(instance, ip, now or datetime.datetime.now(
+            datetime.UTC
+        ))
 
-        return sep.join(line)
-
-    def format(self, instance) -> Optional[str]:
+    def format(self, instance, now=None) -> Optional[str]:
         ips = instance.get_ips_by_type(self.ip_type)
+        now = now or datetime.datetime.now(datetime.UTC)
 
         lines = [
-            self.format_line(instance, ip)
+            self.render(instance, ip, now)
             for ip in ips
         ]
         if not lines:
@@ -276,96 +589,985 @@ class Ec2InstanceFormatter:
 
         return "\n".join(lines)
 
+    def write(self, instances, out=None, flush=False):
+        """
+        Format instances straight to out (stdout by default), batching up
+        writes rather than printing line by line. With flush, each instance
+        is written out as soon as it's formatted instead, for streaming.
+        """
+        out = out or sys.stdout
+        now = datetime.datetime.now(datetime.UTC)
+        render = self.render
+        buffer = []
+
+        for instance in instances:
+            for ip in instance.get_ips_by_type(self.ip_type):
+                buffer.append(render(instance, ip, now))
+                buffer.append("\n")
+
+            if flush or len(buffer) >= WRITE_BATCH_SIZE:
+                out.write("".join(buffer))
+                buffer.clear()
+
+                if flush:
+                    out.flush()
+
+        out.write("".join(buffer))
+        out.flush()
+
 
 class Ec2InstanceFinder:
-    tmp_dir = "/tmp"
+    cache_dir = CACHE_DIR
 
-    def __init__(self, use_cache=True):
-        self.session = self.create_session()
-        self.ec2 = self.session.client("ec2")
+    def __init__(
+        self, use_cache=True, profile=None, region=None,
+        cache_ttl=DEFAULT_CACHE_TTL, refresh=False, filters=None
+    ):
+        self._session = None
+        self._ec2 = None
         self.use_cache = use_cache
+        self.cache_ttl = cache_ttl
+        self.refresh = refresh
+
+        # EC2 API filters to narrow down fetches. These never apply to the
+        # cache, which always holds the full listing, so callers must still
+        # filter results themselves.
+        self.filters = filters or []
+
+        # Only tag instances with their origin if it was asked for explicitly
+        self.profile = profile
+        self.region = region
 
     @staticmethod
-    def create_session():
+    def create_session(profile=None, region=None):
         """
         Create a boto session which reuses the aws cli's credential cache on disk
         """
+        import boto3
+        from botocore import session as core_session
+        from botocore.credentials import JSONFileCache
+
         cache_file = os.path.join(os.path.expanduser("~"), ".aws/cli/cache")
         sess = core_session.get_session()
         sess.get_component("credential_provider").get_provider("assume-role").cache = (
             JSONFileCache(cache_file)
         )
-        return boto3.Session(botocore_session=sess)
+        return boto3.Session(
+            botocore_session=sess, profile_name=profile, region_name=region
+        )
 
     @property
-    def cache_key(self) -> str:
-        access_key = os.environ.get("AWS_ACCESS_KEY_ID", "defaultaccesskey")
-        profile = self.session.profile_name or "default-profile"
-        today = datetime.datetime.today().strftime("%Y-%m-%d")
+    def session(self):
+        if self._session is None:
+            self._session = self.create_session(
+                profile=self.profile, region=self.region
+            )
+
+        return self._session
 
+    @property
+    def ec2(self):
+        if self._ec2 is None:
+            self._ec2 = self.session.client("ec2")
+
+        return self._ec2
+
+    @property
+    def profile_name(self) -> str:
+        """The profile boto would pick, worked out without importing it"""
         return (
-            f"find-ec2-results-{access_key}-{profile}-{today}.json"
+            self.profile or
+            os.environ.get("AWS_PROFILE") or
+            os.environ.get("AWS_DEFAULT_PROFILE") or
+            "default"
         )
 
+    @property
+    def region_name(self) -> Optional[str]:
+        """
+        The region boto would pick, worked out without importing it: from the
+        environment, or failing that the profile's aws cli config
+        """
+        region = (
+            self.region or
+            os.environ.get("AWS_REGION") or
+            os.environ.get("AWS_DEFAULT_REGION")
+        )
+        if region:
+            return region
+
+        config = configparser.ConfigParser()
+        config.read(os.environ.get(
+            "AWS_CONFIG_FILE", os.path.expanduser("~/.aws/config")
+        ))
+
+        profile = self.profile_name
+        section = profile if profile == "default" else f"profile {profile}"
+        return config.get(section, "region", fallback=None)
+
+    @property
+    def cache_key(self) -> str:
+        access_key = os.environ.get("AWS_ACCESS_KEY_ID", "defaultaccesskey")
+        profile = self.profile_name
+        region = self.region_name or "default-region"
+
+        return f"{CACHE_PREFIX}{access_key}-{profile}-{region}.json"
+
     @property
     def cache_file(self) -> str:
-        return os.path.join(self.tmp_dir, self.cache_key)
+        return os.path.join(self.cache_dir, self.cache_key)
+
+    @property
+    def lock_file(self) -> str:
+        return f"{self.cache_file}.lock"
+
+    def cache_age(self) -> Optional[float]:
+        """Seconds since the cache was last written, or None if absent"""
+        try:
+            return time.time() - os.path.getmtime(self.cache_file)
+        except OSError:
+            return None
 
     def write_cache(self, data):
-        with open(self.cache_file, "w") as f:
-            json.dump(data, f, default=serialise_json)
+        """Write the cache, if we can; failing to is only a missed speedup"""
+        try:
+            write_json_atomic(self.cache_file, data)
+        except OSError as e:
+            logger.warning("Could not write cache %s: %s", self.cache_file, e)
+            return
+
+        self.evict_cache()
 
     def read_cache(self):
-        if not os.path.isfile(self.cache_file):
+        data = read_json(self.cache_file)
+
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
             return None
 
-        with open(self.cache_file, "r") as f:
-            return json.load(f)
+        return data
 
-    def get_results(self):
+    def evict_cache(self):
+        """Remove cache files and dead locks nobody has written in a while"""
+        now = time.time()
+
+        pattern = os.path.join(self.cache_dir, f"{CACHE_PREFIX}*")
+        for path in glob.glob(pattern):
+            max_age = (
+                CACHE_LOCK_TIMEOUT if path.endswith(".lock")
+                else CACHE_EVICT_AGE
+            )
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def _acquire_refresh_lock(self) -> bool:
+        """
+        Take the refresh lock, or return False if someone else holds it or
+        we can't take it at all, in which case we just skip the refresh
+        """
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                lock_age = time.time() - os.path.getmtime(self.lock_file)
+            except FileNotFoundError:
+                return self._acquire_refresh_lock()
+            except OSError:
+                return False
+
+            if lock_age < CACHE_LOCK_TIMEOUT:
+                return False
+
+            try:
+                os.utime(self.lock_file)
+            except OSError:
+                return False
+            return True
+        except OSError as e:
+            logger.debug("Could not take refresh lock: %s", e)
+            return False
+
+        os.close(fd)
+        return True
+
+    def release_refresh_lock(self):
+        try:
+            os.unlink(self.lock_file)
+        except OSError:
+            pass
+
+    def refresh_in_background(self):
+        """
+        Spawn a detached copy of this script to refetch and rewrite the
+        cache, unless another refresh is already in flight. The lock is
+        released by the child once it finishes.
+        """
+        if not self._acquire_refresh_lock():
+            return
+
+        cmd = [sys.executable, os.path.abspath(__file__), "--refresh-only"]
+        if self.profile:
+            cmd.extend(["--profiles", self.profile])
+        if self.region:
+            cmd.extend(["--regions", self.region])
+
+        try:
+            subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
+            )
+        except OSError as e:
+            logger.warning("Could not start background refresh: %s", e)
+            self.release_refresh_lock()
+
+    def _read_usable_cache(self):
+        """
+        Read the cache if it's fresh enough to serve, scheduling a background
+        refresh if it has outlived its TTL or a refresh was requested
+        """
+        age = self.cache_age()
+        if age is None or (age > CACHE_MAX_STALE and not self.refresh):
+            return None
+
+        data = self.read_cache()
+        if data is not None and (self.refresh or age > self.cache_ttl):
+            self.refresh_in_background()
+
+        return data
+
+    def iter_pages(self):
+        """
+        Yield pages of raw DescribeInstances results from the API, following
+        NextToken until the account is exhausted
+        """
+        paginator = self.ec2.get_paginator("describe_instances")
+
+        if self.filters:
+            yield from paginator.paginate(Filters=self.filters)
+        else:
+            yield from paginator.paginate()
+
+    def iter_instances(self):
+        """
+        Yield instances page by page, in API order.
+
+        Cached results come from compact records rather than the raw API
+        response. Fresh results are yielded as each page arrives and only
+        written to the cache once the final page has been read, so an
+        interrupted listing never leaves a partial cache behind.
+
+        If API filters were given and the cache can't be used, we fetch only
+        the matching instances, which is much cheaper for targeted lookups,
+        but don't cache them as they're not the full listing. Instead, unless
+        the cache is still fresh, the full listing is refreshed in the
+        background so later lookups can be served from it.
+        """
         if self.use_cache:
-            data = self.read_cache()
+            data = self._read_usable_cache()
 
             if data is not None:
                 self.data = data
-                return self.data
-
-        response = self.ec2.describe_instances()
+                for record in data["instances"]:
+                    yield Ec2Instance.from_record(
+                        record, profile=self.profile, region=self.region
+                    )
+                return
+
+        if self.filters:
+            age = self.cache_age()
+            if age is None or age > self.cache_ttl:
+                self.refresh_in_background()
+
+        records = []
+
+        for page in self.iter_pages():
+            for r in page["Reservations"]:
+                for i in r["Instances"]:
+                    instance = Ec2Instance(
+                        i, profile=self.profile, region=self.region
+                    )
+                    records.append(instance.to_record())
+                    yield instance
+
+        self.data = {"version": CACHE_VERSION, "instances": records}
+        if not self.filters:
+            self.write_cache(self.data)
 
-        # Pass the data in and out of the cache first as we will lose type
-        # information for datetimes when we serialise it, so this makes sure
-        # we have it in a consistent format
-        self.write_cache(response)
-        self.data = self.read_cache()
+    def get_results(self):
+        for _ in self.iter_instances():
+            pass
 
         return self.data
 
     def get_all_instances(self):
-        results = self.get_results()
-        return sorted([
-            Ec2Instance(i)
-            for r in results["Reservations"] for i in r["Instances"]
-        ])
+        return sorted(self.iter_instances())
 
 
-class Ec2InstanceFilter:
+class Ec2MultiFinder:
     """
-    Just filter instances according to pattern config
+    Search several (profile, region) pairs concurrently, presenting the same
+    interface as Ec2InstanceFinder. Each pair gets its own session and client,
+    built inside its worker thread since boto sessions aren't thread-safe, so
+    total latency is roughly that of the slowest single account.
     """
-    def __init__(self, pattern):
-        self.pattern = pattern
+    def __init__(
+        self, profiles=None, regions=None, use_cache=True,
+        cache_ttl=DEFAULT_CACHE_TTL, refresh=False, filters=None
+    ):
+        self.targets = list(itertools.product(
+            profiles or [None], regions or [None]
+        ))
+        self.use_cache = use_cache
+        self.cache_ttl = cache_ttl
+        self.refresh = refresh
+        self.filters = filters
+
+        # Raise, rather than just logging, if any target fails, once the
+        # others have finished. This matters when a missing target would be
+        # mistaken for all its instances disappearing.
+        self.strict = False
+
+    def _fetch(self, profile, region):
+        finder = Ec2InstanceFinder(
+            use_cache=self.use_cache, profile=profile, region=region,
+            cache_ttl=self.cache_ttl, refresh=self.refresh,
+            filters=self.filters
+        )
+        return list(finder.iter_instances())
+
+    def iter_instances(self):
+        """Yield each target's instances as soon as that target completes"""
+        workers = min(MAX_FETCH_WORKERS, len(self.targets))
+
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._fetch, profile, region): (profile, region)
+                for profile, region in self.targets
+            }
+
+            for future in as_completed(futures):
+                profile, region = futures[future]
+                try:
+                    yield from future.result()
+                except Exception as e:
+                    errors.append(e)
+                    logger.error(
+                        "Failed to list instances for profile %s, region "
+                        "%s: %s", profile or "(default)",
+                        region or "(default)", e
+                    )
+
+        if errors and self.strict:
+            raise errors[0]
+
+    def get_all_instances(self):
+        return sorted(self.iter_instances())
 
-    def apply(self, instances):
-        if not self.pattern:
-            return instances
 
+class Ec2DaemonFinder:
+    """
+    Ask a running find_ec2_daemon.py for instances over its unix socket. The
+    daemon keeps sessions and instance lists warm in memory and does the
+    filtering and sorting itself, so only the matching instances come back.
+
+    If the daemon can't be reached or reports an error, we fall back to the
+    finder produced by the fallback callable, which is only created if needed.
+    """
+    def __init__(self, query, fallback, socket_path=DAEMON_SOCKET):
+        self.query = query
+        self.fallback = fallback
+        self.socket_path = socket_path
+
+    @staticmethod
+    def check_peer(sock):
+        """Make sure the daemon is running as us, where we can tell"""
+        if not hasattr(socket, "SO_PEERCRED"):
+            return
+
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        _, uid, _ = struct.unpack("3i", creds)
+        if uid != os.getuid():
+            raise ValueError(f"find-ec2 daemon is running as uid {uid}")
+
+    def query_daemon(self):
+        if not is_own_socket(self.socket_path):
+            raise ValueError(
+                f"{self.socket_path} is not a socket belonging to us"
+            )
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_TIMEOUT)
+            sock.connect(self.socket_path)
+            self.check_peer(sock)
+            sock.sendall(json.dumps(self.query).encode() + b"\n")
+
+            with sock.makefile("rb") as f:
+                response = json.loads(f.readline())
+
+        if "error" in response:
+            raise ValueError(f"find-ec2 daemon error: {response['error']}")
+
+        return response["instances"]
+
+    def _query_records(self):
+        try:
+            return self.query_daemon()
+        except (OSError, ValueError) as e:
+            logger.debug("Falling back to direct mode: %s", e)
+            return None
+
+    def _from_records(self, records):
         return [
-            i for i in instances
-            if i.name and (
-                self.pattern in i.name or self.pattern in i.instance_id
+            Ec2Instance.from_record(record, profile=profile, region=region)
+            for profile, region, record in records
+        ]
+
+    def iter_instances(self):
+        records = self._query_records()
+        if records is None:
+            yield from self.fallback().iter_instances()
+            return
+
+        yield from self._from_records(records)
+
+    def get_all_instances(self):
+        # The daemon has already sorted (or ranked) the results for us
+        records = self._query_records()
+        if records is None:
+            return self.fallback().get_all_instances()
+
+        return self._from_records(records)
+
+
+def _score_window(term, text, start, end):
+    """
+    Score the match of term against text[start:end], which must begin and
+    end on matching characters. Matches get a bonus for being consecutive or
+    starting a word, and are penalised for gaps between them.
+    """
+    score = 0
+    t = 0
+    consecutive = False
+    in_gap = False
+
+    for i in range(start, end):
+        if text[i] != term[t]:
+            score += SCORE_GAP_EXTENSION if in_gap else SCORE_GAP_START
+            consecutive = False
+            in_gap = True
+            continue
+
+        score += SCORE_MATCH
+        if i == 0 or not text[i - 1].isalnum():
+            score += BONUS_BOUNDARY * (
+                BONUS_FIRST_CHAR_MULTIPLIER if t == 0 else 1
             )
+        if consecutive:
+            score += BONUS_CONSECUTIVE
+
+        consecutive = True
+        in_gap = False
+        t += 1
+
+    return score
+
+
+def fuzzy_score(term, text) -> Optional[int]:
+    """
+    Score term as a subsequence of text in the manner of fzf's v1 algorithm,
+    or return None if it doesn't match at all. Exact substrings are always
+    preferred; otherwise we take the leftmost match and then tighten it by
+    scanning backwards from its end.
+    """
+    idx = text.find(term)
+    if idx >= 0:
+        return _score_window(term, text, idx, idx + len(term))
+
+    t = 0
+    end = None
+    for i, c in enumerate(text):
+        if c == term[t]:
+            t += 1
+            if t == len(term):
+                end = i + 1
+                break
+
+    if end is None:
+        return None
+
+    t = len(term) - 1
+    start = end - 1
+    for i in range(end - 1, -1, -1):
+        if text[i] == term[t]:
+            t -= 1
+            if t < 0:
+                start = i
+                break
+
+    return _score_window(term, text, start, end)
+
+
+def _index_keys(text):
+    """
+    Index keys any field containing text as a subsequence must have: each
+    pair of adjacent characters, or the character itself if there's only one
+    """
+    text = text.lower()
+    if len(text) == 1:
+        return {text}
+
+    return {a + b for a, b in zip(text, text[1:])}
+
+
+class FuzzyTerm:
+    """
+    A free-text term, fuzzy-matched against any searchable field. Like fzf,
+    matching is case-insensitive unless the term contains capitals.
+    """
+    def __init__(self, term):
+        self.ignore_case = term == term.lower()
+        self.term = term
+
+        # A cheap C-level rejection test before the scoring pass: fields are
+        # joined by newlines so a match can't span two fields
+        self.regex = re.compile(
+            ".*?".join(re.escape(c) for c in term),
+            re.IGNORECASE if self.ignore_case else 0
+        )
+
+    @staticmethod
+    def searchable_fields(instance):
+        fields = [
+            instance.name,
+            instance.instance_id,
+            instance.private_ip,
+            instance.public_ip
+        ]
+        fields.extend(v for k, v in instance.tags.items() if k != "Name")
+        return [f for f in fields if f]
+
+    def score(self, instance) -> Optional[int]:
+        fields = self.searchable_fields(instance)
+        if not self.regex.search("\n".join(fields)):
+            return None
+
+        if self.ignore_case:
+            fields = [f.lower() for f in fields]
+
+        scores = [
+            fuzzy_score(self.term, f) for f in fields if self.regex.search(f)
+        ]
+        return max((s for s in scores if s is not None), default=None)
+
+    def api_filter(self):
+        """Fuzzy matching has no EC2 equivalent, so can't be pushed down"""
+        return None
+
+    def index_keys(self):
+        return _index_keys(self.term)
+
+
+class InstanceIdTerm:
+    """A term which looks like the start of an instance ID, e.g. i-0abc"""
+    def __init__(self, term):
+        self.prefix = term
+
+    def score(self, instance) -> Optional[int]:
+        if not instance.instance_id.startswith(self.prefix):
+            return None
+
+        return SCORE_MATCH * len(self.prefix)
+
+    def api_filter(self):
+        return {"Name": "instance-id", "Values": [f"{self.prefix}*"]}
+
+    def index_keys(self):
+        return _index_keys(self.prefix)
+
+
+class NameGlobTerm:
+    """A term containing * wildcards, matched against the Name tag"""
+    def __init__(self, term):
+        self.glob = term
+
+    def score(self, instance) -> Optional[int]:
+        if not instance.name or not fnmatch.fnmatchcase(
+            instance.name, self.glob
+        ):
+            return None
+
+        return SCORE_MATCH * len(self.glob.replace("*", ""))
+
+    def api_filter(self):
+        return {"Name": "tag:Name", "Values": [self.glob]}
+
+    def index_keys(self):
+        return set().union(*(
+            _index_keys(part) for part in self.glob.split("*") if part
+        ))
+
+
+class StateTerm:
+    """Restrict instances to a set of states, from --state"""
+    def __init__(self, states):
+        self.states = states
+
+    def score(self, instance) -> Optional[int]:
+        return 0 if instance.state in self.states else None
+
+    def api_filter(self):
+        return {"Name": "instance-state-name", "Values": list(self.states)}
+
+    def index_keys(self):
+        return set()
+
+
+class TagTerm:
+    """
+    A tag:KEY=VALUE term, where VALUE may contain * wildcards. With no
+    =VALUE, any instance carrying the tag matches.
+    """
+    def __init__(self, term):
+        key, _, value = term[len(TAG_TERM_PREFIX):].partition("=")
+        self.key = key
+        self.value = value or None
+
+    def score(self, instance) -> Optional[int]:
+        value = instance.tags.get(self.key)
+        if value is None:
+            return None
+
+        if self.value is None:
+            return 0
+
+        if not fnmatch.fnmatchcase(value, self.value):
+            return None
+
+        # Weight like an exact match so tag terms don't skew the ranking
+        return SCORE_MATCH * len(self.value)
+
+    def api_filter(self):
+        if self.value is None:
+            return {"Name": "tag-key", "Values": [self.key]}
+
+        return {"Name": f"tag:{self.key}", "Values": [self.value]}
+
+    def index_keys(self):
+        if self.value is None:
+            return set()
+
+        return set().union(*(
+            _index_keys(part) for part in self.value.split("*") if part
+        ))
+
+
+class Ec2InstanceDiffer:
+    """
+    Keep a compact snapshot of instances by ID, and report what has changed
+    each time we're shown a new listing. Changes are reported as the listing
+    streams in, apart from removals which we can only know about at the end.
+    """
+    def __init__(self, snapshot=None):
+        # {instance_id: [name, state, private_ip, public_ip]}, or None if
+        # we've yet to see a listing to compare against
+        self.snapshot = snapshot
+
+    @staticmethod
+    def summarise(instance):
+        return [
+            instance.name,
+            instance.state,
+            instance.private_ip,
+            instance.public_ip
         ]
 
+    @staticmethod
+    def _format_ips(private_ip, public_ip):
+        return "/".join(ip or "-" for ip in (private_ip, public_ip))
+
+    def diff(self, instances):
+        """
+        Yield (kind, instance_id, name, detail) tuples describing changes
+        since the last listing. The snapshot is only replaced once instances
+        have been exhausted, so a listing which fails partway is ignored.
+
+        Nothing is yielded for the first listing, which is just recorded.
+        """
+        previous = self.snapshot
+        current = {}
+
+        for instance in instances:
+            summary = self.summarise(instance)
+            current[instance.instance_id] = summary
+
+            if previous is None:
+                continue
+
+            name, state, private_ip, public_ip = summary
+            old = previous.get(instance.instance_id)
+
+            if old is None:
+                ips = self._format_ips(private_ip, public_ip)
+                yield (
+                    CHANGE_LAUNCHED, instance.instance_id, name,
+                    f"{state} {ips}"
+                )
+                continue
+
+            _, old_state, old_private_ip, old_public_ip = old
+
+            if state != old_state:
+                yield (
+                    CHANGE_STATE, instance.instance_id, name,
+                    f"{old_state} -> {state}"
+                )
+
+            if (private_ip, public_ip) != (old_private_ip, old_public_ip):
+                old_ips = self._format_ips(old_private_ip, old_public_ip)
+                ips = self._format_ips(private_ip, public_ip)
+                yield (
+                    CHANGE_IP, instance.instance_id, name,
+                    f"{old_ips} -> {ips}"
+                )
+
+        if previous is not None:
+            for instance_id in previous.keys() - current.keys():
+                name = previous[instance_id][0]
+                yield (CHANGE_REMOVED, instance_id, name, "")
+
+        self.snapshot = current
+
+    @staticmethod
+    def format_change(change):
+        kind, instance_id, name, detail = change
+        return (
+            f"{CHANGE_MARKERS[kind]} {kind : <8} {name or '(no name)' : <34} "
+            f"{instance_id : <21} {detail}"
+        ).rstrip()
+
+
+class Ec2InstanceFilter:
+    """
+    Filter instances according to a pattern of space-separated terms, all of
+    which must match, and rank them by how well they match
+    """
+    def __init__(self, pattern, states=None):
+        self.pattern = pattern
+        self.terms = self.parse_pattern(pattern) if pattern else []
+
+        if states:
+            self.terms.append(StateTerm(states))
+
+    @staticmethod
+    def parse_term(term):
+        if term.startswith(TAG_TERM_PREFIX):
+            return TagTerm(term)
+
+        if INSTANCE_ID_TERM_PATTERN.match(term):
+            return InstanceIdTerm(term)
+
+        if "*" in term:
+            return NameGlobTerm(term)
+
+        return FuzzyTerm(term)
+
+    @classmethod
+    def parse_pattern(cls, pattern):
+        return [cls.parse_term(t) for t in pattern.split()]
+
+    def api_filters(self):
+        """
+        EC2 filters equivalent to whichever terms can be expressed that way.
+        The rest still need to be applied client-side, and since pushed-down
+        terms are cheap to re-check we simply filter on everything.
+        """
+        filters = []
+        seen = set()
+
+        for term in self.terms:
+            f = term.api_filter()
+            if f is None:
+                continue
+
+            # EC2 rejects repeated filter names, so only the first one of
+            # each can be pushed down; the rest are left to the client
+            if f["Name"] in seen:
+                continue
+
+            seen.add(f["Name"])
+            filters.append(f)
+
+        return filters
+
+    def score(self, instance) -> Optional[int]:
+        """Total score across all terms, or None if any term fails"""
+        total = 0
+
+        for term in self.terms:
+            score = term.score(instance)
+            if score is None:
+                return None
+            total += score
+
+        return total
+
+    def matches(self, instance):
+        return self.score(instance) is not None
+
+    def stream(self, instances):
+        """
+        Lazily filter an iterable of instances as they arrive. Unlike apply,
+        this can't rank results as it never sees them all at once.
+        """
+        if not self.terms:
+            yield from instances
+            return
+
+        for i in instances:
+            if self.matches(i):
+                yield i
+
+    def apply(self, instances):
+        """Filter instances, best matches first, otherwise in input order"""
+        if not self.terms:
+            return list(instances)
+
+        scored = []
+        for i in instances:
+            score = self.score(i)
+            if score is not None:
+                scored.append((score, i))
+
+        scored.sort(key=lambda s: -s[0])
+        return [i for _, i in scored]
+
+    def index_keys(self):
+        return set().union(*(t.index_keys() for t in self.terms))
+
+
+class Ec2InstanceIndex:
+    """
+    An index over a long-lived listing, to narrow a search down to the
+    instances which could possibly match before scoring them one by one.
+
+    For each character, and each ordered pair of characters, we keep a bitmap
+    of the instances with a searchable field containing it (case-folded). A
+    field can only contain a term as a subsequence if it contains each pair
+    of adjacent characters from the term in that order, so intersecting the
+    bitmaps for the term's pairs gives a superset of the matches.
+    """
+    def __init__(self, instances):
+        self.instances = instances
+
+        # Fields like tag values repeat across instances, so only work out
+        # the keys for each distinct one once
+        field_keys = {}
+        positions = {}
+
+        for n, instance in enumerate(instances):
+            keys = set()
+
+            for field in FuzzyTerm.searchable_fields(instance):
+                if field not in field_keys:
+                    field_keys[field] = self._field_keys(field.lower())
+                keys.update(field_keys[field])
+
+            for key in keys:
+                positions.setdefault(key, []).append(n)
+
+        self.bitmaps = {
+            key: self._bitmap(p, len(instances))
+            for key, p in positions.items()
+        }
+
+    @staticmethod
+    def _field_keys(field):
+        chars = set(field)
+
+        # a precedes b somewhere iff a's first occurrence precedes b's last
+        first = [(c, field.find(c)) for c in chars]
+        last = [(c, field.rfind(c)) for c in chars]
+
+        return chars.union(a + b for a, i in first for b, j in last if i < j)
+
+    @staticmethod
+    def _bitmap(positions, size):
+        bits = bytearray((size + 7) // 8)
+        for n in positions:
+            bits[n >> 3] |= 1 << (n & 7)
+
+        return int.from_bytes(bits, "little")
+
+    def candidates(self, filter):
+        """Instances which may match filter, in listing order"""
+        keys = filter.index_keys()
+        if not keys:
+            return self.instances
+
+        mask = (1 << len(self.instances)) - 1
+        for key in keys:
+            mask &= self.bitmaps.get(key, 0)
+            if not mask:
+                return []
+
+        # Lowest bit first, so the positions come out in order
+        bits = bin(mask)[:1:-1]
+        candidates = []
+        n = bits.find("1")
+        while n >= 0:
+            candidates.append(self.instances[n])
+            n = bits.find("1", n + 1)
+
+        return candidates
+
+
+def daemon_query(args):
+    """
+    The request to send find_ec2_daemon.py for a search, or None if it can't
+    answer it for us.
+
+    The daemon has its own environment, so we resolve each target's profile
+    and region here rather than letting it fall back on its own defaults,
+    along with the origin we'd tag its instances with ourselves. Credentials
+    from the environment can't be passed on, so the daemon only answers if
+    it has the same access key as us.
+    """
+    targets = []
+
+    for profile, region in itertools.product(
+        args.profiles or [None], args.regions or [None]
+    ):
+        finder = Ec2InstanceFinder(profile=profile, region=region)
+        region_name = finder.region_name
+
+        # boto would have no idea where to look either
+        if region_name is None:
+            return None
+
+        targets.append({
+            "profile": finder.profile_name,
+            "region": region_name,
+            "origin": [profile, region]
+        })
+
+    return {
+        "targets": targets,
+        "access_key": os.environ.get("AWS_ACCESS_KEY_ID"),
+        "pattern": args.pattern,
+        "states": args.states,
+        "refresh": args.refresh
+    }
+
 
 def create_components(args):
     """
@@ -384,28 +1586,178 @@ def create_components(args):
     if not args.format_key and args.show_uptime:
         format_key.append(UPTIME)
 
-    finder = Ec2InstanceFinder(use_cache=args.use_cache)
+    for state in args.states or []:
+        if state not in STATE_NAMES:
+            raise ValueError(f"'{state}' is not a valid instance state")
+
+    filter = Ec2InstanceFilter(args.pattern, states=args.states)
+
+    finder_opts = {
+        "use_cache": args.use_cache,
+        "cache_ttl": args.cache_ttl,
+        "refresh": args.refresh,
+        "filters": filter.api_filters()
+    }
+
+    def create_finder():
+        if args.profiles or args.regions:
+            return Ec2MultiFinder(
+                profiles=args.profiles, regions=args.regions, **finder_opts
+            )
+
+        return Ec2InstanceFinder(**finder_opts)
+
+    query = None
+    if args.use_cache and args.use_daemon and is_own_socket(DAEMON_SOCKET):
+        query = daemon_query(args)
+
+    if query is not None:
+        finder = Ec2DaemonFinder(query=query, fallback=create_finder)
+    else:
+        finder = create_finder()
+
     formatter = Ec2InstanceFormatter(
         format_key=format_key,
         output_format=args.output_format or OUTPUT_PRETTY,
         ip_type=args.ip_type or IP_PRIVATE
     )
-    filter = Ec2InstanceFilter(args.pattern)
 
     return finder, formatter, filter
 
 
+def refresh_cache(args):
+    """
+    Entry point for background refreshes: refetch a single profile/region
+    into the cache, then release the lock taken out by whoever spawned us
+    """
+    finder = Ec2InstanceFinder(
+        use_cache=False,
+        profile=args.profiles[0] if args.profiles else None,
+        region=args.regions[0] if args.regions else None
+    )
+    try:
+        finder.get_results()
+    finally:
+        finder.release_refresh_lock()
+
+
+def snapshot_file(args) -> str:
+    """Where --diff keeps its snapshot for this particular search"""
+    search = json.dumps([
+        args.profiles, args.regions, args.pattern, args.states,
+        os.environ.get("AWS_ACCESS_KEY_ID"), os.environ.get("AWS_PROFILE")
+    ])
+    digest = hashlib.sha1(search.encode()).hexdigest()[:16]
+
+    return os.path.join(
+        Ec2InstanceFinder.cache_dir, f"{CACHE_PREFIX}snapshot-{digest}.json"
+    )
+
+
+def _strict_instances(finder, filter):
+    if isinstance(finder, Ec2MultiFinder):
+        finder.strict = True
+
+    return filter.stream(finder.iter_instances())
+
+
+def run_diff(args):
+    """
+    Report changes since the last --diff with the same search, using the
+    cache as usual. The daemon is skipped, as a partial listing from it would
+    look like instances disappearing.
+    """
+    args.use_daemon = False
+
+    finder, _, filter = create_components(args)
+    path = snapshot_file(args)
+    differ = Ec2InstanceDiffer(read_json(path))
+    baseline = differ.snapshot is None
+
+    for change in differ.diff(_strict_instances(finder, filter)):
+        print(differ.format_change(change), flush=True)
+
+    write_json_atomic(path, differ.snapshot)
+
+    if baseline:
+        logger.warning(
+            "Recorded %d instances to compare against next time",
+            len(differ.snapshot)
+        )
+
+
+def run_watch(args):
+    """
+    Poll for changes until interrupted, always fetching fresh results and
+    backing off while nothing is happening
+    """
+    args.use_cache = False
+    args.use_daemon = False
+
+    finder, _, filter = create_components(args)
+    differ = Ec2InstanceDiffer()
+    interval = args.watch
+
+    while True:
+        changed = False
+
+        try:
+            for change in differ.diff(_strict_instances(finder, filter)):
+                changed = True
+                now = time.strftime("%H:%M:%S")
+                print(f"{now} {differ.format_change(change)}", flush=True)
+        except Exception as e:
+            logger.error("Failed to list instances: %s", e)
+
+        interval = (
+            args.watch if changed else min(interval * 2, MAX_WATCH_INTERVAL)
+        )
+        time.sleep(interval)
+
+
 def main():
     parser = get_argument_parser("find-ec2")
+
+    changes_parser = parser.add_argument_group("changes")
+    changes_parser.add_argument(
+        "--diff", action="store_true", help=(
+            "Only show launches, removals, state transitions and IP changes "
+            "since the last --diff run with the same search"
+        )
+    )
+    changes_parser.add_argument(
+        "--watch", type=float, nargs="?", const=DEFAULT_WATCH_INTERVAL,
+        default=None, metavar="SECONDS", help=(
+            "Poll for changes until interrupted, starting every "
+            f"{DEFAULT_WATCH_INTERVAL}s and backing off to every "
+            f"{MAX_WATCH_INTERVAL}s while nothing changes"
+        )
+    )
     args = parser.parse_args()
 
+    if args.watch is not None and not 0 < args.watch < math.inf:
+        parser.error("--watch must be a positive number of seconds")
+
+    if args.refresh_only:
+        return refresh_cache(args)
+
+    if args.watch is not None:
+        try:
+            return run_watch(args)
+        except KeyboardInterrupt:
+            return
+
+    if args.diff:
+        return run_diff(args)
+
     finder, formatter, filter = create_components(args)
-    instances = filter.apply(finder.get_all_instances())
 
-    for instance in instances:
-        pretty = formatter.format(instance)
-        if pretty:
-            print(pretty)
+    if args.stream:
+        instances = filter.stream(finder.iter_instances())
+    else:
+        instances = filter.apply(finder.get_all_instances())
+
+    formatter.write(instances, flush=args.stream)
 
 
 if __name__ == "__main__":
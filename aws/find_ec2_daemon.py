@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Keep find-ec2 results warm in memory and serve them over a unix socket.
+
+find_ec2.py and ec2_connect.py will query this automatically while it's
+running, which saves them building a boto session and loading the cache on
+every invocation. Listings are refreshed in the background as they age, and
+the on-disk cache is kept up to date as a side-effect so direct mode stays
+fast too.
+
+Protocol: the client sends one line of JSON with targets, a list of
+{"profile", "region", "origin": [profile, region]} objects which it has
+resolved itself, plus the access key it would use and optional pattern,
+states and refresh keys. It receives one line of JSON back, either
+{"instances": [[origin profile, origin region, record], ...]} or
+{"error": "..."}.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import find_ec2
+
+logger = logging.getLogger(__name__)
+
+# How often the background thread looks for listings past their TTL
+REFRESH_CHECK_INTERVAL = 5
+
+
+class Ec2InstanceStore:
+    """
+    Sorted instance listings for each (profile, region) target we've been
+    asked about, each with its own long-lived finder and boto session, and an
+    index to narrow searches through it
+    """
+    def __init__(self, cache_ttl):
+        self.cache_ttl = cache_ttl
+        self.pool = ThreadPoolExecutor(max_workers=find_ec2.MAX_FETCH_WORKERS)
+
+        self.lock = threading.Lock()
+        self.finders = {}
+        self.load_locks = {}
+        self.instances = {}
+        self.indexes = {}
+        self.fetched_at = {}
+        self.refreshing = set()
+
+    def _finder(self, target):
+        with self.lock:
+            if target not in self.finders:
+                profile, region = target
+
+                # Name the profile and region explicitly unless they're our
+                # own defaults, as a "default" profile needn't actually exist
+                own = find_ec2.Ec2InstanceFinder()
+                if profile == own.profile_name:
+                    profile = None
+                if region == own.region_name:
+                    region = None
+
+                # Never let the finder spawn its own refreshers; we handle
+                # freshness ourselves
+                self.finders[target] = find_ec2.Ec2InstanceFinder(
+                    profile=profile, region=region,
+                    cache_ttl=find_ec2.CACHE_MAX_STALE
+                )
+                self.load_locks[target] = threading.Lock()
+
+            return self.finders[target], self.load_locks[target]
+
+    def load(self, target, use_cache=True):
+        finder, load_lock = self._finder(target)
+
+        with load_lock:
+            finder.use_cache = use_cache
+            age = finder.cache_age() if use_cache else None
+            instances = sorted(finder.iter_instances())
+
+        # Label instances with the target they were asked for under, which
+        # may differ from what the finder knows it by
+        for instance in instances:
+            instance.profile, instance.region = target
+
+        with self.lock:
+            self.instances[target] = instances
+            self.indexes.pop(target, None)
+            self.fetched_at[target] = time.time() - (age or 0)
+            self.refreshing.discard(target)
+
+        logger.info(
+            "Loaded %d instances for %s from %s", len(instances), target,
+            "cache" if age is not None else "EC2"
+        )
+
+        # Indexing takes longer than a search without one, so don't make the
+        # request which loaded the listing wait for it
+        self.pool.submit(self._index, target, instances)
+
+    def _index(self, target, instances):
+        index = find_ec2.Ec2InstanceIndex(instances)
+
+        with self.lock:
+            # Unless it's been reloaded in the meantime
+            if self.instances.get(target) is instances:
+                self.indexes[target] = index
+
+    def _refresh(self, target):
+        try:
+            self.load(target, use_cache=False)
+        except Exception:
+            logger.exception("Failed to refresh %s", target)
+            with self.lock:
+                self.refreshing.discard(target)
+
+    def schedule_refresh(self, target):
+        with self.lock:
+            if target in self.refreshing:
+                return
+            self.refreshing.add(target)
+
+        self.pool.submit(self._refresh, target)
+
+    def refresh_stale(self):
+        now = time.time()
+
+        with self.lock:
+            stale = [
+                t for t, fetched_at in self.fetched_at.items()
+                if now - fetched_at > self.cache_ttl
+            ]
+
+        for target in stale:
+            self.schedule_refresh(target)
+
+    def get(self, targets, refresh=False, filter=None):
+        """
+        Sorted instances across targets, loading any we haven't seen. Given a
+        filter, those which can't match it may be left out.
+        """
+        with self.lock:
+            missing = [t for t in targets if t not in self.instances]
+
+        # Load unseen targets in parallel, raising the first failure
+        for future in [self.pool.submit(self.load, t) for t in missing]:
+            future.result()
+
+        if refresh:
+            for target in targets:
+                self.schedule_refresh(target)
+
+        with self.lock:
+            listings = [
+                (self.instances[t], self.indexes.get(t)) for t in targets
+            ]
+
+        listings = [
+            index.candidates(filter) if index and filter else instances
+            for instances, index in listings
+        ]
+
+        return list(heapq.merge(*listings))
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # Just a liveness check
+            return
+
+        try:
+            request = json.loads(line)
+            response = {"instances": self.query(**request)}
+        except Exception as e:
+            logger.exception("Failed to handle request")
+            response = {"error": str(e)}
+
+        self.wfile.write(
+            json.dumps(response, separators=(",", ":")).encode() + b"\n"
+        )
+
+    def query(
+        self, targets, access_key=None, pattern=None, states=None,
+        refresh=False
+    ):
+        if access_key != os.environ.get("AWS_ACCESS_KEY_ID"):
+            raise ValueError(
+                "The client's credentials differ from the daemon's"
+            )
+
+        origins = {
+            (t["profile"], t["region"]): t["origin"] for t in targets
+        }
+        filter = find_ec2.Ec2InstanceFilter(pattern, states=states)
+        instances = self.server.store.get(
+            list(origins), refresh=refresh, filter=filter
+        )
+
+        return [
+            origins[(i.profile, i.region)] + [i.to_record()]
+            for i in filter.apply(instances)
+        ]
+
+
+class Ec2DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, store):
+        self.store = store
+        super().__init__(socket_path, RequestHandler)
+
+
+def socket_in_use(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+
+    return True
+
+
+def refresh_loop(store):
+    while True:
+        time.sleep(REFRESH_CHECK_INTERVAL)
+        store.refresh_stale()
+
+
+def main():
+    parser = argparse.ArgumentParser("find-ec2-daemon")
+    parser.add_argument(
+        "--socket", default=find_ec2.DAEMON_SOCKET, help=(
+            "Listen on this unix socket. Clients look for "
+            f"$FIND_EC2_SOCKET, or {find_ec2.DAEMON_SOCKET} by default"
+        )
+    )
+    parser.add_argument(
+        "--cache-ttl", type=int, default=find_ec2.DEFAULT_CACHE_TTL,
+        help="Seconds before a listing is refreshed in the background"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(message)s")
+    logger.setLevel(logging.INFO)
+
+    if os.path.lexists(args.socket):
+        if not find_ec2.is_own_socket(args.socket):
+            logger.error(
+                "%s exists and isn't a socket belonging to us; refusing to "
+                "listen there", args.socket
+            )
+            sys.exit(1)
+
+        if socket_in_use(args.socket):
+            logger.error("A daemon is already listening on %s", args.socket)
+            sys.exit(1)
+
+        # Left behind by a previous daemon which died
+        os.unlink(args.socket)
+
+    # Exit via SystemExit so the socket gets cleaned up below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    store = Ec2InstanceStore(cache_ttl=args.cache_ttl)
+    threading.Thread(target=refresh_loop, args=(store,), daemon=True).start()
+
+    os.makedirs(
+        os.path.dirname(args.socket) or ".", mode=0o700, exist_ok=True
+    )
+
+    # Create the socket owner-only from the start, rather than chmodding it
+    # after other users have had a chance to connect
+    umask = os.umask(0o177)
+    try:
+        server = Ec2DaemonServer(args.socket, store)
+    finally:
+        os.umask(umask)
+
+    with server:
+        logger.info("Listening on %s", args.socket)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Tests for find_ec2.py, with EC2 replaced by a stubbed botocore client
+"""
+
+import contextlib
+import datetime
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import boto3
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+# The scripts here import each other as top-level modules, as they do when
+# run from this directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import find_ec2  # noqa: E402
+
+LAUNCH_TIME = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+
+# Total time find-ec2 may spend importing modules when serving results from
+# the cache. boto3 alone takes longer than this to import.
+CACHED_IMPORT_BUDGET = 0.2
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+\d+ \| +(\S+)$")
+
+
+def instance_data(instance_id, name, private_ip):
+    return {
+        "InstanceId": instance_id,
+        "LaunchTime": LAUNCH_TIME,
+        "State": {"Name": "running", "Code": find_ec2.STATE_RUNNING},
+        "PrivateIpAddress": private_ip,
+        "Tags": [{"Key": "Name", "Value": name}]
+    }
+
+
+def page(instances, next_token=None):
+    response = {
+        "Reservations": [{"ReservationId": "r-0", "Instances": instances}]
+    }
+    if next_token:
+        response["NextToken"] = next_token
+
+    return response
+
+
+# Three pages, deliberately out of name order
+PAGES = [
+    page([instance_data("i-03", "zeta", "10.0.0.3")], "token-1"),
+    page([
+        instance_data("i-01", "alpha", "10.0.0.1"),
+        instance_data("i-02", "mu", "10.0.0.2")
+    ], "token-2"),
+    page([instance_data("i-04", "beta", "10.0.0.4")])
+]
+
+
+class StubbedEc2TestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+
+        self.ec2 = boto3.client(
+            "ec2", region_name="eu-west-1", aws_access_key_id="testing",
+            aws_secret_access_key="testing"
+        )
+        self.stubber = Stubber(self.ec2)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+
+        for p in [
+            mock.patch.object(
+                find_ec2.Ec2InstanceFinder, "cache_dir", self.cache_dir.name
+            ),
+            mock.patch.object(find_ec2.Ec2InstanceFinder, "ec2", self.ec2),
+            mock.patch.dict(os.environ, {"AWS_REGION": "eu-west-1"})
+        ]:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def add_pages(self, pages):
+        next_token = None
+
+        for p in pages:
+            params = {"NextToken": next_token} if next_token else {}
+            self.stubber.add_response("describe_instances", p, params)
+            next_token = p.get("NextToken")
+
+
+class PaginationTest(StubbedEc2TestCase):
+    def test_follows_every_page_in_api_order(self):
+        self.add_pages(PAGES)
+        finder = find_ec2.Ec2InstanceFinder(use_cache=False)
+
+        ids = [i.instance_id for i in finder.iter_instances()]
+
+        self.assertEqual(ids, ["i-03", "i-01", "i-02", "i-04"])
+        self.stubber.assert_no_pending_responses()
+
+    def test_cache_written_after_last_page(self):
+        self.add_pages(PAGES)
+        finder = find_ec2.Ec2InstanceFinder()
+        instances = finder.iter_instances()
+
+        # Everything from the first two pages
+        for _ in range(3):
+            next(instances)
+        self.assertFalse(os.path.exists(finder.cache_file))
+
+        self.assertEqual(next(instances).instance_id, "i-04")
+        self.assertFalse(os.path.exists(finder.cache_file))
+
+        self.assertEqual(list(instances), [])
+        self.assertEqual(
+            [r[0] for r in finder.read_cache()["instances"]],
+            ["i-03", "i-01", "i-02", "i-04"]
+        )
+
+    def test_failed_listing_not_cached(self):
+        self.add_pages(PAGES[:1])
+        self.stubber.add_client_error(
+            "describe_instances", "RequestLimitExceeded",
+            expected_params={"NextToken": "token-1"}
+        )
+        finder = find_ec2.Ec2InstanceFinder()
+
+        with self.assertRaises(ClientError):
+            list(finder.iter_instances())
+
+        self.assertFalse(os.path.exists(finder.cache_file))
+
+    def test_cached_listing_matches_fetched(self):
+        self.add_pages(PAGES)
+        fetched = find_ec2.Ec2InstanceFinder().get_all_instances()
+        cached = find_ec2.Ec2InstanceFinder().get_all_instances()
+
+        self.assertEqual(
+            [(i.instance_id, i.name, i.private_ip, i.launch_time)
+             for i in cached],
+            [(i.instance_id, i.name, i.private_ip, i.launch_time)
+             for i in fetched]
+        )
+        self.stubber.assert_no_pending_responses()
+
+
+class StreamTest(StubbedEc2TestCase):
+    def run_main(self, *args):
+        """
+        Run find-ec2, returning a log of the pages it fetched and the output
+        it wrote, in the order they happened
+        """
+        events = []
+        iter_pages = find_ec2.Ec2InstanceFinder.iter_pages
+
+        def logged_iter_pages(finder):
+            for p in iter_pages(finder):
+                events.append("page")
+                yield p
+
+        class Output(io.StringIO):
+            def write(self, s):
+                if s:
+                    events.extend(s.splitlines())
+                return super().write(s)
+
+        argv = ["find-ec2", "--no-daemon", "--tsv", "--format-key", "name"]
+        argv.extend(args)
+
+        with (
+            mock.patch.object(
+                find_ec2.Ec2InstanceFinder, "iter_pages", logged_iter_pages
+            ),
+            mock.patch("sys.argv", argv),
+            contextlib.redirect_stdout(Output())
+        ):
+            find_ec2.main()
+
+        return events
+
+    def test_stream_prints_each_page_as_it_arrives(self):
+        self.add_pages(PAGES)
+
+        self.assertEqual(self.run_main("--stream"), [
+            "page", "zeta", "page", "alpha", "mu", "page", "beta"
+        ])
+
+    def test_stream_filters_as_it_goes(self):
+        self.add_pages(PAGES)
+
+        self.assertEqual(self.run_main("--stream", "a"), [
+            "page", "zeta", "page", "alpha", "page", "beta"
+        ])
+
+    def test_default_output_is_sorted(self):
+        self.add_pages(PAGES)
+
+        self.assertEqual(self.run_main(), [
+            "page", "page", "page", "alpha", "beta", "mu", "zeta"
+        ])
+
+
+class IndexTest(unittest.TestCase):
+    """The index may only rule out instances which can't match"""
+    def setUp(self):
+        self.instances = sorted(find_ec2.Ec2Instance(i) for i in [
+            instance_data("i-0a1", "web-1", "10.0.0.1"),
+            instance_data("i-0b2", "web-2", "10.0.0.2"),
+            instance_data("i-0c3", "db-19", "10.0.1.9"),
+            instance_data("i-0d4", "Batch-91", "10.0.9.1")
+        ])
+        self.index = find_ec2.Ec2InstanceIndex(self.instances)
+
+    def assert_candidates(self, pattern, expected):
+        filter = find_ec2.Ec2InstanceFilter(pattern)
+        candidates = self.index.candidates(filter)
+
+        self.assertEqual([i.name for i in candidates], expected)
+        self.assertEqual(
+            filter.apply(candidates), filter.apply(self.instances)
+        )
+
+    def test_fuzzy_terms(self):
+        self.assert_candidates("w2", ["web-2"])
+        self.assert_candidates("d19", ["db-19"])
+        self.assert_candidates("BAT", ["Batch-91"])
+        self.assert_candidates("x", [])
+
+    def test_other_terms(self):
+        self.assert_candidates("i-0c", ["db-19"])
+        self.assert_candidates("web-*", ["web-1", "web-2"])
+        self.assert_candidates("tag:Name", [
+            "Batch-91", "db-19", "web-1", "web-2"
+        ])
+
+
+class DaemonQueryTest(unittest.TestCase):
+    """The daemon must search where we would, not where it would"""
+    def query(self, env, *argv):
+        args = find_ec2.get_argument_parser().parse_args(argv)
+
+        with mock.patch.dict(os.environ, env, clear=True):
+            return find_ec2.daemon_query(args)
+
+    def test_resolves_default_target(self):
+        query = self.query({"AWS_PROFILE": "prod", "AWS_REGION": "eu-west-1"})
+
+        self.assertEqual(query["targets"], [
+            {"profile": "prod", "region": "eu-west-1", "origin": [None, None]}
+        ])
+        self.assertIsNone(query["access_key"])
+
+    def test_resolves_each_target(self):
+        query = self.query(
+            {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "AKIA"},
+            "--profiles", "dev,prod"
+        )
+
+        self.assertEqual(query["targets"], [
+            {"profile": "dev", "region": "us-east-1", "origin": ["dev", None]},
+            {
+                "profile": "prod", "region": "us-east-1",
+                "origin": ["prod", None]
+            }
+        ])
+        self.assertEqual(query["access_key"], "AKIA")
+
+    def test_unknown_region(self):
+        self.assertIsNone(
+            self.query({"AWS_CONFIG_FILE": os.devnull, "HOME": os.devnull})
+        )
+
+
+class CachedImportTest(unittest.TestCase):
+    """Keep the cached path from importing boto, or much else"""
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        # Nothing from the real environment which could change what we read
+        self.env = {
+            k: v for k, v in os.environ.items()
+            if not k.startswith(("AWS_", "FIND_EC2_", "XDG_"))
+        }
+        self.env.update({
+            "HOME": tmp.name,
+            "XDG_CACHE_HOME": tmp.name,
+            "AWS_REGION": "eu-west-1",
+            "FIND_EC2_SOCKET": os.path.join(tmp.name, "no-daemon.sock")
+        })
+
+        with mock.patch.dict(os.environ, self.env, clear=True):
+            finder = find_ec2.Ec2InstanceFinder()
+            finder.cache_dir = os.path.join(tmp.name, "find-ec2")
+            finder.write_cache({
+                "version": find_ec2.CACHE_VERSION,
+                "instances": [
+                    find_ec2.Ec2Instance(
+                        instance_data("i-01", "alpha", "10.0.0.1")
+                    ).to_record()
+                ]
+            })
+
+    def test_cached_imports(self):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", find_ec2.__file__],
+            env=self.env, capture_output=True, text=True, check=True
+        )
+        self.assertIn("alpha", result.stdout)
+
+        imports = [
+            IMPORT_TIME_PATTERN.match(line)
+            for line in result.stderr.splitlines()
+        ]
+        modules = [m.group(2) for m in imports if m]
+        total = sum(int(m.group(1)) for m in imports if m) / 1e6
+
+        self.assertTrue(modules)
+        self.assertEqual(
+            [m for m in modules if m.split(".")[0] in ("boto3", "botocore")],
+            []
+        )
+        self.assertLess(total, CACHED_IMPORT_BUDGET)
+
+
+if __name__ == "__main__":
+    unittest.main()
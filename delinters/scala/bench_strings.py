@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Time how long strings.py takes to scan a corpus of scala sources, excluding
+reading the files, e.g.
+
+    ./bench_strings.py ~/src/some-scala-project
+"""
+
+import argparse
+import time
+
+import sources
+from strings import StringValidator
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the string scanner over a corpus'
+    )
+    parser.add_argument(
+        'paths', nargs='+', metavar='path',
+        help='Scala files, or directories to search for them'
+    )
+    parser.add_argument(
+        '-n', '--repeat', type=int, default=5,
+        help='Times to scan the corpus; the best is reported'
+    )
+    args = parser.parse_args()
+
+    corpus = []
+    for filename in sources.find_scala_files(args.paths):
+        with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+            corpus.append(f.read())
+
+    size = sum(len(source) for source in corpus)
+    best = None
+
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        found = sum(
+            len(StringValidator('-', source=source).find_strings())
+            for source in corpus
+        )
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print('{} files, {:.1f}MB, {} strings: best of {} {:.3f}s ({:.1f}MB/s)'
+          .format(len(corpus), size / 1e6, found, args.repeat, best,
+                  size / 1e6 / best))
+
+
+if __name__ == '__main__':
+    main()
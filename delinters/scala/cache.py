@@ -0,0 +1,83 @@
+"""
+An on-disk cache of delinter results, keyed by file content
+
+Each entry is keyed by a hash of the tool, its version and the content it was
+run on, so a file which hasn't changed since a previous run can be skipped
+wherever it lives. Changing the tool itself invalidates all of its entries.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'scala-delinters'
+)
+
+
+def file_version(path):
+    """A version string for a tool, which changes whenever its source does"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, tool, version, directory=CACHE_DIR, enabled=True):
+        """
+        :param tool: The name of the tool caching results
+        :param version: Anything which affects the tool's results, like
+            file_version(__file__) and any relevant configuration
+        """
+        self.directory = os.path.join(directory, tool)
+        self.enabled = enabled
+        self._prefix = '{}\0{}\0'.format(tool, version).encode('utf-8')
+
+    def key(self, content):
+        """The cache key for some file content, given as bytes"""
+        return hashlib.sha1(self._prefix + content).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        """A cached result, or None if there isn't one"""
+        if not self.enabled:
+            return None
+
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        """
+        Cache a result. Failing to write is harmless, so isn't an error, and
+        the write is atomic so concurrent runs never see partial results.
+        """
+        if not self.enabled:
+            return
+
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+
+        try:
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp.')
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except BaseException as e:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+            if not isinstance(e, OSError):
+                raise
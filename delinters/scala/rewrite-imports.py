@@ -1,34 +1,39 @@
 #!/usr/bin/env python3
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import difflib
+import functools
+import io
 import os
+import re
+import shutil
+import stat
 import sys
+import tempfile
 
-NAMESPACE = os.environ.get('SCALA_PROJECT_NAMESPACE')
-
-
-def _is_stdlib(s):
-    """Imports from stdlib like import scala.concurrent.duration.Duration"""
-    prefixes = {
-        'java.',
-        'javax.',
-        'javaw.',
-        'scala.'
-    }
-    for p in prefixes:
-        if s.startswith('import ' + p):
-            return True
+from cache import ResultCache, file_version
+import sources
 
-    return False
+NAMESPACE = os.environ.get('SCALA_PROJECT_NAMESPACE')
 
 
-def _is_project(s):
-    """Imports from the current project, like import com.example.foo.Bar"""
-    return s.startswith('import ' + NAMESPACE)
+# Which group an import belongs in, by prefix, in order of precedence:
+#   stdlib: import scala.concurrent.duration.Duration
+#   project: imports from the current project, like import com.example.foo.Bar
+#   class: imports from a class/object like import DefaultJsonProtocol._
+# Anything else is a third party import.
+IMPORT_GROUP_PATTERN = re.compile(
+    r'import (?:(?P<stdlib>(?:java|javax|javaw|scala)\.)' +
+    (r'|(?P<project>{})'.format(re.escape(NAMESPACE)) if NAMESPACE else '') +
+    r'|(?P<class>[A-Z]))'
+)
+IMPORT_GROUPS = ['stdlib', 'third_party', 'project', 'class']
 
 
-def _is_class(s):
-    """Imports from a class/object like import DefaultJsonProtocol._"""
-    return s.startswith('import ') and len(s) > 7 and s[7].isupper()
+def _import_group(s):
+    m = IMPORT_GROUP_PATTERN.match(s)
+    return m.lastgroup if m else 'third_party'
 
 
 def _sort_key(s):
@@ -37,17 +42,12 @@ def _sort_key(s):
     return underscores_first
 
 
-def rewrite_file(ff):
-    print('Rewriting {}...'.format(ff))
-
-    data = []
-    with open(ff, 'r') as f:
-        data = f.readlines()
+def rewrite_imports(data):
+    """Sort and group the imports in a file's lines, returning the new lines"""
+    imports = {group: [] for group in IMPORT_GROUPS}
 
-    stdlib_imports = []
-    third_party_imports = []
-    project_imports = []
-    class_imports = []
+    # Separate the groups with the file's own line ending
+    newline = '\r\n' if data and data[0].endswith('\r\n') else '\n'
 
     continuation = False  # Multi-line import (brace left unclosed)
     i = None
@@ -73,36 +73,15 @@ def rewrite_file(ff):
             continuation = True
             continue
 
-        if _is_stdlib(i):
-            stdlib_imports.append(i)
-        elif _is_project(i):
-            project_imports.append(i)
-        elif _is_class(i):
-            class_imports.append(i)
-        else:
-            third_party_imports.append(i)
-
-    stdlib_imports.sort(key=_sort_key)
-    third_party_imports.sort(key=_sort_key)
-    project_imports.sort(key=_sort_key)
-    class_imports.sort(key=_sort_key)
-
-    for import_list in [
-        stdlib_imports,
-        third_party_imports,
-        project_imports,
-        class_imports
-    ]:
-        if import_list:
-            import_list.insert(0, '\n')
-
-    all_imports = (
-        stdlib_imports +
-        third_party_imports +
-        project_imports +
-        class_imports +
-        ['\n']
-    )
+        imports[_import_group(i)].append(i)
+
+    all_imports = []
+    for group in IMPORT_GROUPS:
+        if imports[group]:
+            all_imports.append(newline)
+            all_imports.extend(sorted(imports[group], key=_sort_key))
+
+    all_imports.append(newline)
 
     patched = []
     finished_patching = False
@@ -124,14 +103,158 @@ def rewrite_file(ff):
             patched.extend(all_imports)
             finished_patching = True
 
-    with open(ff, 'w') as f:
-        f.writelines(patched)
+    return patched
+
+
+def read_header(f):
+    """
+    Read lines from a binary file up to the start of its body: the first line
+    after the package declaration which isn't blank or part of an import.
+    Imports can only appear before this, so there's no need to parse further.
+
+    :returns: A (header, has_package, first_body_line) tuple, all bytes except
+        has_package. f is left positioned just after first_body_line.
+    """
+    header = []
+    has_package = False
+    continuation = False  # Multi-line import (brace left unclosed)
+
+    for line in iter(f.readline, b''):
+        if continuation:
+            continuation = b'}' not in line
+        elif line.startswith(b'import'):
+            continuation = b'{' in line and b'}' not in line
+        elif has_package and line.strip():
+            return b''.join(header), has_package, line
+        elif line.startswith(b'package'):
+            has_package = True
+
+        header.append(line)
+
+    return b''.join(header), has_package, b''
+
+
+def write_atomic(ff, content, rest=None):
+    """
+    Replace a file's content via a temp file and rename, so it's never seen
+    half-written and an interrupted run can't truncate it
+
+    :param rest: A file object to copy the remainder of the content from
+    """
+    dirname, basename = os.path.split(ff)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname or '.', prefix='.' + basename)
+
+    try:
+        os.chmod(tmp_path, stat.S_IMODE(os.stat(ff).st_mode))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            if rest:
+                shutil.copyfileobj(rest, f)
+        os.replace(tmp_path, ff)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def rewrite_file(ff, cache, check=False):
+    """
+    Rewrite the imports in a file, unless we've already seen its header and
+    know it's tidy. Only the header is parsed; the body is copied as-is, and
+    only if the header would change. Files with no package declaration are
+    left alone.
+
+    :param check: Don't write anything, just work out what would change
+    :returns: A (filename, changed, diff, error) tuple. diff is only given in
+        check mode.
+    """
+    try:
+        with open(ff, 'rb') as f:
+            header, has_package, first_body_line = read_header(f)
+            key = cache.key(header)
+
+            if not has_package or cache.get(key):
+                return ff, False, None, None
+
+            # Keep line endings as they are, to match the untouched body
+            text = header.decode('utf-8')
+            data = io.StringIO(text, newline='').readlines()
+            patched_text = ''.join(rewrite_imports(data))
+            patched = patched_text.encode('utf-8')
+
+            changed = patched != header
+            diff = None
+
+            if changed and check:
+                # Include the start of the body for context
+                body = first_body_line.decode('utf-8', 'replace')
+                diff = ''.join(difflib.unified_diff(
+                    data + [body],
+                    patched_text.splitlines(keepends=True) + [body],
+                    fromfile=ff, tofile=ff
+                ))
+            elif changed:
+                write_atomic(ff, patched + first_body_line, rest=f)
+
+        # Whether or not we wrote it, this header needs no more work
+        cache.put(cache.key(patched), True)
+    except (OSError, UnicodeDecodeError) as e:
+        return ff, False, None, str(e)
+
+    return ff, changed, diff, None
+
+
+def rewrite_files(filenames, jobs, cache, check=False):
+    """
+    Rewrite many files in parallel
+
+    :returns: An iterator of rewrite_file results, in the order given
+    """
+    rewrite = functools.partial(rewrite_file, cache=cache, check=check)
+
+    if jobs <= 1 or len(filenames) <= 1:
+        yield from map(rewrite, filenames)
+        return
+
+    chunksize = max(1, len(filenames) // (jobs * 4))
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(rewrite, filenames, chunksize=chunksize)
 
 
 def main():
-    if len(sys.argv) <= 1:
-        print('Filenames to rewrite required')
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description='Sort and group the imports in scala files, in place'
+    )
+    parser.add_argument(
+        'paths', nargs='+', metavar='path',
+        help=(
+            'Scala files, or directories to search for them, skipping '
+            'src_managed and anything ignored by git'
+        )
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help=(
+            'Print a diff of what would change instead of rewriting '
+            'anything, and fail if any file needs rewriting'
+        )
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='Files to rewrite in parallel (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--changed-since', metavar='REF',
+        help='Only rewrite files changed since this git ref'
+    )
+    parser.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help=(
+            'Rewrite every file, rather than skipping those with the same '
+            'content as the output of a previous run'
+        )
+    )
+    args = parser.parse_args()
 
     if not NAMESPACE:
         print(
@@ -139,9 +262,47 @@ def main():
             'environment variable'
         )
 
+    try:
+        filenames = sources.find_scala_files(
+            args.paths, changed_since=args.changed_since
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    # The namespace changes which group imports go in
+    cache = ResultCache(
+        'rewrite-imports',
+        '{}:{}'.format(file_version(__file__), NAMESPACE),
+        enabled=args.use_cache
+    )
+
     print('Own project namespace: {}'.format(NAMESPACE))
-    for f in sys.argv[1:]:
-        rewrite_file(f)
+
+    changed = 0
+    failed = 0
+
+    for ff, file_changed, diff, error in rewrite_files(
+        filenames, args.jobs, cache, check=args.check
+    ):
+        if error:
+            failed += 1
+            print(
+                'Unable to rewrite {}: {}'.format(ff, error), file=sys.stderr
+            )
+        elif file_changed:
+            changed += 1
+            if diff:
+                sys.stdout.write(diff)
+            else:
+                print('Rewrote {}'.format(ff))
+
+    print('{} of {} files {}'.format(
+        changed, len(filenames),
+        'need their imports rewriting' if args.check else 'rewritten'
+    ))
+
+    if failed or (args.check and changed):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
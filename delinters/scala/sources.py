@@ -0,0 +1,142 @@
+"""
+Find the scala sources the delinters in this directory should look at
+"""
+
+import os
+import subprocess
+
+# Generated code; not ours to lint
+EXCLUDED_DIRS = {'src_managed'}
+
+
+def _is_excluded(path):
+    return any(
+        part in EXCLUDED_DIRS for part in os.path.normpath(path).split(os.sep)
+    )
+
+
+def _git_files(directory):
+    """
+    Scala files under directory which git doesn't ignore, or None if it isn't
+    in a git repo
+    """
+    try:
+        output = subprocess.run(
+            [
+                'git', 'ls-files', '-z', '--cached', '--others',
+                '--exclude-standard', '--', '*.scala'
+            ],
+            cwd=directory, capture_output=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return [
+        os.path.join(directory, f)
+        for f in output.decode('utf-8', 'surrogateescape').split('\0') if f
+    ]
+
+
+def _git(directory, *args):
+    """
+    Run a git command in directory, returning its output
+
+    :raises ValueError: If it fails, with the first line of git's error
+    """
+    try:
+        return subprocess.run(
+            ['git', '-C', directory] + list(args),
+            capture_output=True, check=True
+        ).stdout.decode('utf-8', 'surrogateescape')
+    except subprocess.CalledProcessError as e:
+        error = e.stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise ValueError(
+            error[0] if error else 'git {} failed'.format(args[0])
+        )
+    except OSError as e:
+        raise ValueError('Unable to run git: {}'.format(e))
+
+
+def changed_files(ref, paths):
+    """
+    Real paths of files changed since a git ref, either committed or in the
+    working tree, including untracked files git doesn't ignore. Each path is
+    looked up in its own repo, wherever we happen to be run from.
+
+    :raises ValueError: If git can't tell us, e.g. the ref doesn't exist
+    """
+    toplevels = set()
+
+    for path in paths:
+        directory = path if os.path.isdir(path) else os.path.dirname(path)
+        try:
+            toplevels.add(_git(
+                directory or '.', 'rev-parse', '--show-toplevel'
+            ).strip())
+        except ValueError as e:
+            raise ValueError(
+                'Unable to find files changed since {} in {}: {}'.format(
+                    ref, path, e
+                )
+            )
+
+    changed = set()
+
+    for toplevel in toplevels:
+        try:
+            output = _git(
+                toplevel, 'diff', '-z', '--name-only', '--diff-filter=d', ref,
+                '--'
+            ) + _git(
+                toplevel, 'ls-files', '-z', '--others', '--exclude-standard'
+            )
+        except ValueError as e:
+            raise ValueError(
+                'Unable to find files changed since {}: {}'.format(ref, e)
+            )
+
+        changed.update(
+            os.path.realpath(os.path.join(toplevel, f))
+            for f in output.split('\0') if f
+        )
+
+    return changed
+
+
+def _walk_files(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d not in EXCLUDED_DIRS]
+
+        for f in files:
+            if f.lower().endswith('.scala'):
+                yield os.path.join(root, f)
+
+
+def find_scala_files(paths, changed_since=None):
+    """
+    Expand the given paths into a sorted list of scala files. Files are taken
+    as they are, and directories are searched for anything ending in .scala,
+    skipping generated code and anything covered by a .gitignore.
+
+    :param changed_since: Only include files changed since this git ref
+    """
+    found = set()
+
+    for path in paths:
+        if not os.path.isdir(path):
+            found.add(path)
+            continue
+
+        files = _git_files(path)
+        if files is None:
+            files = _walk_files(path)
+
+        found.update(
+            f for f in files if not _is_excluded(f) and os.path.isfile(f)
+        )
+
+    if changed_since is not None:
+        changed = changed_files(changed_since, paths)
+        found = {f for f in found if os.path.realpath(f) in changed}
+
+    return sorted(found)
@@ -1,104 +1,217 @@
 #!/usr/bin/env python3
 
+import argparse
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import os
 import re
 import sys
 
+from cache import ResultCache, file_version
+import sources
+
 
 class StringValidator(object):
-    INTERPOLATION_PATTERN = re.compile(r'^.*\$[a-zA-Z\{].*$')
+    INTERPOLATION_PATTERN = re.compile(r'\$[a-zA-Z_\{]')
     INTERPOLATION_CHARS = {'s', 'f'}
 
-    def __init__(self, filename):
+    # Everything in code which could affect where strings are. Complete
+    # single-line and triple quoted strings are matched outright; anything
+    # else is scanned by hand from the opening quote.
+    _TOKENS = (
+        r"(?P<line_comment>//[^\n]*+)"
+        r"|(?P<block_comment>/\*)"
+        r"|(?P<char>'(?:\\u[0-9a-fA-F]{4}|\\.|[^'\\\n])')"
+        r"|(?P<backtick>`[^`\n]*+`)"
+        r'|(?P<triple>"""[\s\S]*?"""(?!"))'
+        r'|(?P<string>"(?!"")(?:[^"\\\n]++|\\.)*+")'
+        r'|(?P<quote>"(?:"")?)'
+    )
+    CODE_TOKEN = re.compile(_TOKENS)
+
+    # Inside an interpolation we also need braces, to find its end
+    INTERPOLATION_TOKEN = re.compile(
+        _TOKENS + r'|(?P<open>\{)|(?P<close>\})'
+    )
+
+    # Characters any of the above can start with. Searching for these alone
+    # lets the regex engine skip over the rest of the code far more quickly
+    # than searching for the tokens themselves.
+    CODE_TOKEN_START = re.compile(r'[/\'`"]')
+    INTERPOLATION_TOKEN_START = re.compile(r'[/\'`"{}]')
+
+    BLOCK_COMMENT_TOKEN = re.compile(r'/\*|\*/')
+
+    # The end of a string, or anything within it which needs attention. Only
+    # interpolated strings care about $; a triple quote may be followed by
+    # extra quotes, which belong to the string.
+    PLAIN_STRING_TOKEN = re.compile(r'\\.|"|\n')
+    INTERPOLATED_STRING_TOKEN = re.compile(r'\\.|\$\$|\$\{|"|\n')
+    PLAIN_TRIPLE_TOKEN = re.compile(r'"""(?!")')
+    INTERPOLATED_TRIPLE_TOKEN = re.compile(r'\$\$|\$\{|"""(?!")')
+
+    def __init__(self, filename, source=None):
         def _parse_file(f):
-            self.lines = [l.strip() for l in f.readlines()]
+            self.source = f.read()
 
-        if filename == '-':
+        if source is not None:
+            self.source = source
+        elif filename == '-':
             _parse_file(sys.stdin)
         else:
-            with open(filename, 'rb') as f:
+            with open(filename, 'r', encoding='utf-8', errors='replace') as f:
                 _parse_file(f)
 
-    def find_strings(self):
-        """Scan lines for strings and summarise them"""
-        found = []
+        self.line_starts = [0] + [
+            m.end() for m in re.finditer('\n', self.source)
+        ]
+
+    def position(self, offset):
+        """1-based (line, column) of an offset into the source"""
+        line = bisect.bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+    def _skip_block_comment(self, pos):
+        """Skip a (possibly nested) block comment opened just before pos"""
+        depth = 1
+
+        while depth:
+            m = self.BLOCK_COMMENT_TOKEN.search(self.source, pos)
+            if not m:
+                return len(self.source)
+
+            depth += 1 if m.group() == '/*' else -1
+            pos = m.end()
+
+        return pos
+
+    def _interpolator(self, offset):
+        """The identifier immediately before offset, if any"""
+        start = offset
+        while start and (
+            self.source[start - 1].isalnum() or self.source[start - 1] == '_'
+        ):
+            start -= 1
+
+        while start < offset and self.source[start].isdigit():
+            start += 1
+
+        return self.source[start:offset] or None
+
+    def _scan_code(self, pos, found, in_interpolation=False):
+        """
+        Scan code from pos, collecting string literals into found. Inside an
+        interpolation, stop after the brace which closes it.
+
+        :returns: The offset at which scanning stopped
+        """
+        if in_interpolation:
+            token_start = self.INTERPOLATION_TOKEN_START
+            token = self.INTERPOLATION_TOKEN
+        else:
+            token_start = self.CODE_TOKEN_START
+            token = self.CODE_TOKEN
+
+        depth = 0
+
+        while True:
+            start = token_start.search(self.source, pos)
+            if not start:
+                return len(self.source)
+
+            # Probably just division or a symbol literal
+            m = token.match(self.source, start.start())
+            if not m:
+                pos = start.end()
+                continue
+
+            pos = m.end()
+            kind = m.lastgroup
+
+            if kind == 'block_comment':
+                pos = self._skip_block_comment(pos)
+            elif kind in ('triple', 'string', 'quote'):
+                pos = self._scan_string(m, found)
+            elif kind == 'open':
+                depth += 1
+            elif kind == 'close':
+                if not depth:
+                    return pos
+                depth -= 1
+
+    def _add_string(self, found, offset, content, interpolator):
+        line_num, column = self.position(offset)
+        found.append({
+            'content': content,
+            'interpolated': interpolator,
+            'line_num': line_num,
+            'column': column
+        })
+
+    def _scan_string(self, m, found):
+        """
+        Scan a string literal starting at m, adding it to found
+
+        :returns: The offset just after the literal
+        """
+        quote = m.start()
+        interpolator = self._interpolator(quote)
+        offset = quote - len(interpolator or '')
+        literal = m.group()
+
+        # A complete literal was matched, and there can't be anything nested
+        # inside it which would move the closing quote
+        if m.lastgroup != 'quote' and not (
+            interpolator and '${' in literal
+        ):
+            quotes = 3 if m.lastgroup == 'triple' else 1
+            self._add_string(
+                found, offset, literal[quotes:-quotes], interpolator
+            )
+            return m.end()
+
+        triple = self.source.startswith('"""', quote)
+        start = pos = quote + (3 if triple else 1)
+
+        if triple:
+            token = (
+                self.INTERPOLATED_TRIPLE_TOKEN if interpolator
+                else self.PLAIN_TRIPLE_TOKEN
+            )
+        else:
+            token = (
+                self.INTERPOLATED_STRING_TOKEN if interpolator
+                else self.PLAIN_STRING_TOKEN
+            )
+
+        while True:
+            t = token.search(self.source, pos)
 
-        curr_string = ''
-        open_string = False
-        interpolated = None
-        last_char = None
-        last_non_quote = None
-        open_triple = False
-        quote_count = 0
-
-        # Find strings semi-intelligently
-        for i, line in enumerate(self.lines):
-            for c in line:
-                if c == '"':
-                    quote_count += 1
-
-                    # Looks like the string is being terminated
-                    if open_string:
-                        if (
-                            quote_count == 3 or
-                            not open_triple and last_char != '\\'
-                        ):
-                            # This might be the start of a triple; we'll
-                            # decide on the next character
-                            if quote_count == 2:
-                                continue
-
-                            found.append({
-                                'content': curr_string,
-                                'interpolated': interpolated,
-                                'line_num': i + 1
-                            })
-
-                            # Reset values
-                            open_string = False
-                            curr_string = ''
-                            interpolated = None
-                            quote_count = 0
-                            continue
-                    # Looks like a string is starting
-                    else:
-                        open_triple = quote_count == 3
-                        interpolated = (
-                            last_char
-                            if last_char in self.INTERPOLATION_CHARS else None
-                        )
-                        open_string = True
-                        continue
-                else:
-                    # Suspected a 3-opener but it was actually just an empty
-                    # string. Close it off and add it to the strings now
-                    if quote_count == 2:
-                        found.append({
-                            'content': curr_string,
-                            'interpolated': interpolated,
-                            'line_num': i + 1
-                        })
-                        open_string = False
-                        curr_string = ''
-                        interpolated = None
-                        quote_count = 0
-                        continue
-
-                    quote_count = 0
-
-                last_char = c
-
-                if open_string:
-                    curr_string += c
-
-            if not open_triple:
-                open_string = False
-                quote_count = 0
-                curr_string = ''
-                interpolated = None
-                last_char = None
-            else:
-                last_char = '\n'
+            # Unterminated; give up on it
+            if not t or t.group() == '\n':
+                return t.end() if t else len(self.source)
 
+            pos = t.end()
+            if t.group() == '${':
+                pos = self._scan_code(pos, found, in_interpolation=True)
+            elif t.group().startswith('"'):
+                break
+
+        self._add_string(
+            found, offset, self.source[start:t.start()], interpolator
+        )
+        return pos
+
+    def find_strings(self):
+        """
+        Scan the source for string literals and summarise them, in the order
+        they start. Comments, char literals and backticked identifiers are
+        skipped, and strings within ${...} interpolations are found too.
+        """
+        found = []
+        self._scan_code(0, found)
+        found.sort(key=lambda s: (s['line_num'], s['column']))
         return found
 
     def validate_string(self, details):
@@ -107,38 +220,164 @@ class StringValidator(object):
 
         :returns: None if valid, reason string if invalid
         """
-        seems_interpolated = bool(self.INTERPOLATION_PATTERN.match(
+        interpolator = details['interpolated']
+
+        # Custom interpolators (raw, json, sql etc.) may do anything
+        if interpolator and interpolator not in self.INTERPOLATION_CHARS:
+            return None
+
+        seems_interpolated = bool(self.INTERPOLATION_PATTERN.search(
             details['content']
         ))
 
-        if seems_interpolated and not details['interpolated']:
+        if seems_interpolated and not interpolator:
             return (
                 'Possible missing s or f on string "{content}", '
-                'line {line_num}'
-            ).format(details)
+                'line {line_num}, column {column}'
+            ).format(**details)
 
-        if not seems_interpolated and details['interpolated']:
+        if not seems_interpolated and interpolator:
             return (
                 'Possible unneeded {interpolated} on string '
-                '{interpolated}"{content}", line {line_num}'
-            ).format(details)
+                '{interpolated}"{content}", line {line_num}, column {column}'
+            ).format(**details)
 
         return None
 
-    def run(self):
-        found = self.find_strings()
-
-        n = 0
-        for s in found:
+    def issues(self):
+        """Each string found which fails validation, with the reason"""
+        for s in self.find_strings():
             error = self.validate_string(s)
             if error:
-                n += 1
-                print(error)
+                yield s, error
+
+    def run(self):
+        n = 0
+        for _, error in self.issues():
+            n += 1
+            print(error)
 
         if n:
             print('{} string interpolation issues found'.format(n))
         return n
 
 
+def check_file(filename, cache):
+    """
+    Validate a single file, for use in a worker process. Files we've already
+    seen the same content for are skipped.
+
+    :returns: A list of (filename, line, column, error) tuples
+    """
+    try:
+        with open(filename, 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        return [(filename, 0, 0, 'Unable to read file: {}'.format(e.strerror))]
+
+    key = cache.key(content)
+    issues = cache.get(key)
+
+    if issues is None:
+        # Decode as open() would in text mode
+        source = content.decode('utf-8', 'replace')
+        source = source.replace('\r\n', '\n').replace('\r', '\n')
+
+        validator = StringValidator(filename, source=source)
+        issues = [
+            [s['line_num'], s['column'], error]
+            for s, error in validator.issues()
+        ]
+        cache.put(key, issues)
+
+    return [
+        (filename, line_num, column, error)
+        for line_num, column, error in issues
+    ]
+
+
+def check_files(filenames, jobs, cache):
+    """
+    Validate many files in parallel
+
+    :returns: All issues found, sorted by file and position
+    """
+    check = functools.partial(check_file, cache=cache)
+
+    if jobs <= 1 or len(filenames) <= 1:
+        results = map(check, filenames)
+        return sorted(issue for issues in results for issue in issues)
+
+    # Big chunks cut down on IPC, but leave a few per worker so one slow
+    # chunk doesn't hold up the end of the run
+    chunksize = max(1, len(filenames) // (jobs * 4))
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(check, filenames, chunksize=chunksize)
+        return sorted(issue for issues in results for issue in issues)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            'Look for scala strings which seem to be missing an s '
+            'interpolator, or have one they don\'t need'
+        )
+    )
+    parser.add_argument(
+        'paths', nargs='+', metavar='path',
+        help=(
+            'Scala files, or directories to search for them, skipping '
+            'src_managed and anything ignored by git. Use - for stdin.'
+        )
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='Files to check in parallel (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--changed-since', metavar='REF',
+        help='Only check files changed since this git ref'
+    )
+    parser.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help=(
+            'Check every file, rather than skipping those with the same '
+            'content as a previous run'
+        )
+    )
+    args = parser.parse_args()
+
+    # Checking a single file gives the original output, without filenames
+    if (
+        len(args.paths) == 1 and not os.path.isdir(args.paths[0]) and
+        not args.changed_since
+    ):
+        n = StringValidator(args.paths[0]).run()
+        sys.exit(min(n, 255))
+
+    try:
+        filenames = sources.find_scala_files(
+            args.paths, changed_since=args.changed_since
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    cache = ResultCache(
+        'strings', file_version(__file__), enabled=args.use_cache
+    )
+    issues = check_files(filenames, args.jobs, cache)
+
+    for filename, line_num, column, error in issues:
+        print('{}: {}'.format(filename, error))
+
+    if issues:
+        print('{} string interpolation issues found in {} of {} files'.format(
+            len(issues), len({i[0] for i in issues}), len(filenames)
+        ))
+
+    sys.exit(min(len(issues), 255))
+
+
 if __name__ == '__main__':
-    sys.exit(StringValidator(sys.argv[1]).run())
+    main()
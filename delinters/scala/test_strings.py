@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from strings import StringValidator
+
+
+def find_strings(source):
+    return [
+        (s['content'], s['interpolated'], s['line_num'], s['column'])
+        for s in StringValidator('<test>', source=source).find_strings()
+    ]
+
+
+def issues(source):
+    return [
+        error for _, error in StringValidator('<test>', source=source).issues()
+    ]
+
+
+class FindStringsTest(unittest.TestCase):
+    def test_plain_string(self):
+        self.assertEqual(
+            find_strings('val a = "hello"\n'),
+            [('hello', None, 1, 9)]
+        )
+
+    def test_interpolated_string_starts_at_interpolator(self):
+        self.assertEqual(
+            find_strings('val a = 1\n  val b = s"a is $a"\n'),
+            [('a is $a', 's', 2, 11)]
+        )
+
+    def test_escaped_quotes(self):
+        self.assertEqual(
+            find_strings(r'val a = "say \"hi\"" + "x"'),
+            [(r'say \"hi\"', None, 1, 9), ('x', None, 1, 24)]
+        )
+
+    def test_nested_interpolation(self):
+        content = 'a ${b.map(x => s"<${x}>").mkString("{", ",", "}")} c'
+
+        self.assertEqual(find_strings('s"' + content + '"'), [
+            (content, 's', 1, 1),
+            ('<${x}>', 's', 1, 18),
+            ('{', None, 1, 38),
+            (',', None, 1, 43),
+            ('}', None, 1, 48),
+        ])
+
+    def test_braces_inside_interpolation(self):
+        self.assertEqual(
+            find_strings('s"${xs.map { x => x }} done" + "after"'),
+            [('${xs.map { x => x }} done', 's', 1, 1), ('after', None, 1, 32)]
+        )
+
+    def test_line_comment(self):
+        self.assertEqual(
+            find_strings('// "not a string"\nval a = "real" // "nor this"\n'),
+            [('real', None, 2, 9)]
+        )
+
+    def test_nested_block_comment(self):
+        source = (
+            '/* outer /* inner */ "still a comment"\n'
+            '*/ val a = "real"\n'
+        )
+        self.assertEqual(find_strings(source), [('real', None, 2, 12)])
+
+    def test_unclosed_block_comment(self):
+        self.assertEqual(find_strings('val a = "x" /* "y"\n'), [
+            ('x', None, 1, 9)
+        ])
+
+    def test_triple_quoted(self):
+        source = 'val a = """line one\nline "two"\n"""\nval b = "after"\n'
+
+        self.assertEqual(find_strings(source), [
+            ('line one\nline "two"\n', None, 1, 9),
+            ('after', None, 4, 9),
+        ])
+
+    def test_triple_quoted_with_trailing_quotes(self):
+        self.assertEqual(
+            find_strings('val a = """say "hi""""" + "x"'),
+            [('say "hi""', None, 1, 9), ('x', None, 1, 27)]
+        )
+
+    def test_empty_strings(self):
+        self.assertEqual(
+            find_strings('val a = "" + """"""'),
+            [('', None, 1, 9), ('', None, 1, 14)]
+        )
+
+    def test_interpolated_triple_quoted(self):
+        source = 's"""a ${"b"} "c" """'
+
+        self.assertEqual(find_strings(source), [
+            ('a ${"b"} "c" ', 's', 1, 1),
+            ('b', None, 1, 9),
+        ])
+
+    def test_char_literals(self):
+        source = (
+            "val q = '\"'\n"
+            "val e = '\\''\n"
+            "val u = '\\u0022'\n"
+            "val s = \"x\""
+        )
+
+        self.assertEqual(find_strings(source), [('x', None, 4, 9)])
+
+    def test_symbol_literal_is_not_a_char(self):
+        self.assertEqual(
+            find_strings("val s = 'sym\nval a = \"x\""),
+            [('x', None, 2, 9)]
+        )
+
+    def test_backticked_identifiers(self):
+        self.assertEqual(
+            find_strings('val `"weird"` = "x"'),
+            [('x', None, 1, 17)]
+        )
+
+    def test_unterminated_string(self):
+        self.assertEqual(
+            find_strings('val a = "oops\nval b = s"ok $b"\n'),
+            [('ok $b', 's', 2, 9)]
+        )
+
+    def test_unterminated_triple_quoted(self):
+        self.assertEqual(find_strings('val a = "x"\nval b = """oops\n'), [
+            ('x', None, 1, 9)
+        ])
+
+    def test_custom_interpolators(self):
+        self.assertEqual(
+            find_strings('raw"\\d+ $x" + json"{}" + my_sql2"q"'),
+            [
+                ('\\d+ $x', 'raw', 1, 1),
+                ('{}', 'json', 1, 15),
+                ('q', 'my_sql2', 1, 26),
+            ]
+        )
+
+    def test_division_is_not_a_comment(self):
+        self.assertEqual(
+            find_strings('val a = b / c / "d"'),
+            [('d', None, 1, 17)]
+        )
+
+
+class IssuesTest(unittest.TestCase):
+    def test_missing_interpolator(self):
+        self.assertEqual(issues('val a = 1\nval b = "a is ${a}"'), [
+            'Possible missing s or f on string "a is ${a}", line 2, column 9'
+        ])
+
+    def test_unneeded_interpolator(self):
+        self.assertEqual(issues('  f"no args"'), [
+            'Possible unneeded f on string f"no args", line 1, column 3'
+        ])
+
+    def test_valid_strings(self):
+        source = (
+            'val a = s"$b" + f"$c%.2f" + "plain" + "$5" + s"${"x"}"\n'
+            'val d = raw"$notchecked" + q"unused"\n'
+        )
+        self.assertEqual(issues(source), [])
+
+    def test_strings_nested_in_interpolations(self):
+        self.assertEqual(issues('s"${f("$x")}"'), [
+            'Possible missing s or f on string "$x", line 1, column 7'
+        ])
+
+    def test_commented_out_strings(self):
+        self.assertEqual(issues('// "$a"\n/* s"b" /* */ */'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,290 @@
 #!/usr/bin/env python3
+"""
+Pretty-print XML, as minidom's toprettyxml would with blank lines and
+trailing whitespace removed, but writing it out as it's parsed instead of
+building the whole document in memory first
+"""
+
 import sys
-from xml.dom import minidom
+from xml.parsers import expat
+
+INDENT = '  '
+NEWL = '\n'
+
+# What an element has seen so far. minidom writes a single text child inline,
+# so we have to hold on to the first child until we know if there are more.
+PENDING = 'pending'
+OPEN = 'open'
+
+TEXT = 'text'
+CDATA = 'cdata'
+
+
+def escape(data):
+    return data.replace('&', '&amp;').replace('<', '&lt;'). \
+        replace('"', '&quot;').replace('>', '&gt;')
+
+
+def qualified_name(name):
+    """Turn an expat namespace-separated name back into prefix:localname"""
+    parts = name.split(' ')
+    if len(parts) == 3:
+        return '{}:{}'.format(parts[2], parts[1])
+    return parts[-1]
+
+
+class LineFilter(object):
+    """
+    Drop blank lines and trailing whitespace from text as it's written. Text
+    is processed in batches, which is much quicker than line by line.
+    """
+    BATCH_SIZE = 1 << 16
+
+    def __init__(self, out):
+        self.out = out
+        self.pending = []
+        self.size = 0
+
+    def write(self, s):
+        self.pending.append(s)
+        self.size += len(s)
+
+        if self.size >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self, final=False):
+        lines = ''.join(self.pending).split('\n')
+        partial = '' if final else lines.pop()
+
+        self.out.write(''.join(l.rstrip() + '\n' for l in lines if l.strip()))
+        self.pending = [partial]
+        self.size = len(partial)
+
+    def close(self):
+        self.flush(final=True)
+
+
+class Frame(object):
+    __slots__ = ('tag', 'indent', 'child_indent', 'state', 'buffered',
+                 'current')
+
+    def __init__(self, tag, indent, child_indent, state):
+        self.tag = tag
+        self.indent = indent
+        self.child_indent = child_indent
+        self.state = state
+
+        # A first text child, as [kind, chunks], held until we know if it's
+        # the only child
+        self.buffered = None
+
+        # The kind of text child currently being written out, if any
+        self.current = None
+
+
+class XmlPrettyPrinter(object):
+    def __init__(self, out):
+        self.out = LineFilter(out)
+        self.write = self.out.write
+
+        # The document itself, whose children aren't indented
+        self.stack = [Frame(None, '', '', OPEN)]
+
+        self.in_cdata = False
+        self.cdata_continue = False
+        self.ns_declarations = []
+        self.doctype = None
+        self.subset = None
+
+        self.parser = self.create_parser()
+
+    def create_parser(self):
+        """A parser configured the same way as minidom's"""
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.namespace_prefixes = True
+        parser.buffer_text = True
+        parser.ordered_attributes = True
+        parser.specified_attributes = True
+
+        parser.StartDoctypeDeclHandler = self.start_doctype
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.StartNamespaceDeclHandler = self.start_namespace
+        parser.CharacterDataHandler = self.character_data
+        parser.StartCdataSectionHandler = self.start_cdata
+        parser.EndCdataSectionHandler = self.end_cdata
+        parser.CommentHandler = self.comment
+        parser.ProcessingInstructionHandler = self.processing_instruction
+        parser.ExternalEntityRefHandler = lambda *args: 1
+
+        return parser
+
+    def parse(self, f):
+        self.write('<?xml version="1.0" ?>' + NEWL)
+        self.parser.ParseFile(f)
+        self.out.close()
+
+    def _write_node(self, kind, data, indent='', newl=''):
+        if kind == TEXT:
+            self.write(escape(indent + data + newl))
+        else:
+            self.write('<![CDATA[' + data + ']]>')
+
+    def _open_child(self, frame):
+        """Prepare to write a new child node into frame"""
+        if frame.state == PENDING:
+            self.write('>' + NEWL)
+            frame.state = OPEN
+
+            if frame.buffered:
+                kind, chunks = frame.buffered
+                self._write_node(
+                    kind, ''.join(chunks), frame.child_indent, NEWL
+                )
+                frame.buffered = None
+
+        elif frame.current:
+            self.write(NEWL if frame.current == TEXT else ']]>')
+            frame.current = None
+
+    def start_doctype(self, name, system_id, public_id, has_internal_subset):
+        self.doctype = (name, system_id, public_id)
+
+        if not has_internal_subset:
+            self.write_doctype()
+            return
+
+        # Capture the internal subset verbatim, comments and all
+        self.subset = []
+        self.parser.CommentHandler = None
+        self.parser.ProcessingInstructionHandler = None
+        self.parser.DefaultHandlerExpand = self.subset.append
+        self.parser.EndDoctypeDeclHandler = self.end_doctype
+
+    def end_doctype(self):
+        self.parser.DefaultHandlerExpand = None
+        self.parser.CommentHandler = self.comment
+        self.parser.ProcessingInstructionHandler = self.processing_instruction
+
+        self.subset = ''.join(self.subset). \
+            replace('\r\n', '\n').replace('\r', '\n')
+        self.write_doctype()
+
+    def write_doctype(self):
+        name, system_id, public_id = self.doctype
+
+        self.write('<!DOCTYPE ' + name)
+        if public_id:
+            self.write("{}  PUBLIC '{}'{}  '{}'".format(
+                NEWL, public_id, NEWL, system_id
+            ))
+        elif system_id:
+            self.write("{}  SYSTEM '{}'".format(NEWL, system_id))
+        if self.subset is not None:
+            self.write(' [' + self.subset + ']')
+        self.write('>' + NEWL)
+
+    def start_namespace(self, prefix, uri):
+        self.ns_declarations.append((prefix, uri))
+
+    def start_element(self, name, attributes):
+        parent = self.stack[-1]
+        self._open_child(parent)
+
+        tag = qualified_name(name)
+        indent = parent.child_indent
+        self.write(indent + '<' + tag)
+
+        # minidom puts namespace declarations before other attributes
+        for prefix, uri in self.ns_declarations:
+            self.write(' {}="{}"'.format(
+                'xmlns:' + prefix if prefix else 'xmlns', escape(uri or '')
+            ))
+        self.ns_declarations = []
+
+        for i in range(0, len(attributes), 2):
+            self.write(' {}="{}"'.format(
+                qualified_name(attributes[i]), escape(attributes[i + 1])
+            ))
+
+        self.stack.append(Frame(tag, indent, indent + INDENT, PENDING))
+
+    def end_element(self, name):
+        frame = self.stack.pop()
+
+        if frame.state == OPEN:
+            if frame.current:
+                self.write(NEWL if frame.current == TEXT else ']]>')
+            self.write(frame.indent + '</' + frame.tag + '>' + NEWL)
+        elif frame.buffered:
+            kind, chunks = frame.buffered
+            self.write('>')
+            self._write_node(kind, ''.join(chunks))
+            self.write('</' + frame.tag + '>' + NEWL)
+        else:
+            self.write('/>' + NEWL)
+
+    def character_data(self, data):
+        frame = self.stack[-1]
+        kind = CDATA if self.in_cdata else TEXT
+
+        # Text is merged into the previous node if it's text, and so is
+        # CDATA if it's from the same section
+        last = frame.buffered[0] if frame.buffered else frame.current
+        merge = last == kind and (kind == TEXT or self.cdata_continue)
+        self.cdata_continue = self.in_cdata
+
+        if frame.state == PENDING and (merge or not frame.buffered):
+            if merge:
+                frame.buffered[1].append(data)
+            else:
+                frame.buffered = [kind, [data]]
+            return
+
+        if not merge:
+            self._open_child(frame)
+            self.write(
+                escape(frame.child_indent) if kind == TEXT else '<![CDATA['
+            )
+            frame.current = kind
+
+        self.write(escape(data) if kind == TEXT else data)
+
+    def start_cdata(self):
+        self.in_cdata = True
+        self.cdata_continue = False
+
+    def end_cdata(self):
+        self.in_cdata = False
+        self.cdata_continue = False
+
+    def comment(self, data):
+        frame = self.stack[-1]
+        self._open_child(frame)
+        self.write(frame.child_indent + '<!--' + data + '-->' + NEWL)
+
+    def processing_instruction(self, target, data):
+        frame = self.stack[-1]
+        self._open_child(frame)
+        self.write('{}<?{} {}?>{}'.format(
+            frame.child_indent, target, data, NEWL
+        ))
+
 
-filename = '/dev/stdin'
+def main():
+    filename = '/dev/stdin'
 
-if len(sys.argv) > 1:
-    filename = sys.argv[1]
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
 
-formatted = minidom.parse(filename).toprettyxml(indent='  ')
+    with open(filename, 'rb') as f:
+        try:
+            XmlPrettyPrinter(sys.stdout).parse(f)
+        except expat.ExpatError as e:
+            sys.stdout.flush()
+            print('Invalid XML: {}'.format(e), file=sys.stderr)
+            sys.exit(1)
 
-# Remove blank lines and trailing whitespace
-lines = [
-    l.rstrip() for l in formatted.split('\n') if l.strip()
-]
 
-print('\n'.join(lines))
+if __name__ == '__main__':
+    main()
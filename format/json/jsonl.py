@@ -1,22 +1,57 @@
 #!/usr/bin/env python
 
+import gzip
+import io
 import json
 import sys
 
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Nesting of each record within the output document
+RECORD_INDENT = ' ' * 8
+
+
+def open_input(filename):
+    """
+    Open a jsonl file for reading as text, or stdin if filename is - or
+    missing. Gzipped input is detected and decompressed on the fly.
+    """
+    if filename in (None, '-'):
+        f = sys.stdin.buffer
+    else:
+        f = open(filename, 'rb')
+
+    if f.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        f = gzip.GzipFile(fileobj=f)
+
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+def convert(f, out):
+    """
+    Convert jsonl into a formatted json document under a "lines" key, one
+    record at a time. The output is identical to formatting all the records
+    in one go, but only one record is ever held in memory.
+    """
+    first = True
+
+    for l in f:
+        if not l.strip():
+            continue
+
+        record = json.dumps(json.loads(l), indent=4, sort_keys=True)
+        out.write('{\n    "lines": [\n' if first else ',\n')
+        out.write(RECORD_INDENT)
+        out.write(record.replace('\n', '\n' + RECORD_INDENT))
+        first = False
+
+    out.write('{\n    "lines": []\n}\n' if first else '\n    ]\n}\n')
+
 
 def main():
     """Convert a jsonl file into a formatted json file under a "lines" key"""
-    lines = []
-    with open(sys.argv[1], 'r') as f:
-        lines = [json.loads(l) for l in f.readlines() if l]
-
-    print(
-        json.dumps(
-            {'lines': lines},
-            indent=4,
-            sort_keys=True
-        )
-    )
+    with open_input(sys.argv[1] if len(sys.argv) > 1 else None) as f:
+        convert(f, sys.stdout)
 
 if __name__ == '__main__':
     main()
@@ -2,33 +2,513 @@
 """
 Hacky script to extract data from some JSON:
 
-Pipe a JSON file to this script and provide a line of python code,
+Pipe a JSON file to this script and provide a path to the data you want,
 referring to the json data as `data`
 
 eg.
 $ echo '{"hodor": {"hodor": "hodor!"}}' | \\
 >   ./parse-json.py "data['hodor']['hodor']"
 hodor!
+
+Paths are made of keys (data['key'] or data.key), indices (data[0]),
+wildcards (data[*] or data.*) and slices (data[1:10:2]), and the leading
+`data` is optional. Wildcards and slices may produce many results, which are
+printed one after another.
+
+With --lines, the input is JSON lines instead, and the path is applied to
+each record in turn, optionally spread across several --workers.
+
+The input is parsed as it's read, skipping anything which isn't on the path,
+and reading stops as soon as the path can't match anything more. Negative
+indices and slices need the whole list they apply to, so avoid them on huge
+lists.
 """
 
+import argparse
+import ast
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import itertools
 import json
+import re
 import sys
 
+KEY = 'key'
+INDEX = 'index'
+SLICE = 'slice'
+WILDCARD = 'wildcard'
+
+# Records handed to each worker at a time in --lines mode
+LINES_BATCH_SIZE = 1000
+
+
+class JsonStream(object):
+    """
+    Incremental reader for a JSON document from a file object, which only
+    keeps as much of the input in memory as it needs
+    """
+    CHUNK_SIZE = 1 << 16
+
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+    STRING = re.compile(r'"(?:[^"\\]++|\\.)*+"')
+
+    # Everything up to the next bracket which isn't in a string, or to the
+    # start of a string which is cut off by the end of the buffer
+    STRUCTURE = re.compile(r'(?:[^"\[\]{}]++|"(?:[^"\\]++|\\.)*+")*+')
+    SCALAR = re.compile(
+        r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null'
+    )
+
+    # Anything up to the end of the buffer which a token could continue with
+    CONTINUATION = re.compile(r'[\w.+-]*\Z')
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+        # Start of a value being read, which can't be discarded yet
+        self.mark = None
+
+    def _more(self):
+        """Read another chunk, discarding what's been consumed"""
+        if self.eof:
+            return False
+
+        chunk = self.f.read(self.CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+
+        keep = self.pos if self.mark is None else self.mark
+        self.buf = self.buf[keep:] + chunk
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark -= keep
+
+        return True
+
+    def error(self, expected):
+        found = self.buf[self.pos:self.pos + 20] or 'end of input'
+        return ValueError('Invalid JSON: expected {}, found {!r}'.format(
+            expected, found
+        ))
+
+    def peek(self):
+        """The next non-whitespace character, or '' at the end of input"""
+        while True:
+            self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise self.error(repr(char))
+        self.pos += 1
+
+    def _match(self, pattern, expected):
+        """
+        Match a complete token at the current position, reading more input
+        if it might continue beyond the end of the buffer
+        """
+        while True:
+            m = pattern.match(self.buf, self.pos)
+            if m and not self.CONTINUATION.match(self.buf, m.end()):
+                return m
+            if not self._more():
+                m = pattern.match(self.buf, self.pos)
+                if not m:
+                    raise self.error(expected)
+                return m
+
+    def read_string(self):
+        self.peek()
+        m = self._match(self.STRING, 'a string')
+        self.pos = m.end()
+        return json.loads(m.group())
+
+    def skip_value(self):
+        c = self.peek()
+
+        if c == '"':
+            self.pos = self._match(self.STRING, 'a string').end()
+        elif c in ('{', '['):
+            self._skip_container()
+        else:
+            self.pos = self._match(self.SCALAR, 'a value').end()
+
+    def _skip_container(self):
+        depth = 0
+
+        while True:
+            self.pos = self.STRUCTURE.match(self.buf, self.pos).end()
+
+            # Read more if we ran out, or a string was cut off
+            if self.pos == len(self.buf) or self.buf[self.pos] == '"':
+                if not self._more():
+                    raise self.error('the end of a list or object')
+                continue
+
+            c = self.buf[self.pos]
+            self.pos += 1
+            if c in ('{', '['):
+                depth += 1
+            elif c in ('}', ']'):
+                depth -= 1
+                if not depth:
+                    return
+
+    def read_value(self):
+        """Read and decode the next value in full"""
+        self.peek()
+        self.mark = self.pos
+
+        try:
+            self.skip_value()
+            return json.loads(self.buf[self.mark:self.pos])
+        finally:
+            self.mark = None
+
+    def iter_object(self):
+        """
+        Yield each key in the next object, leaving the stream positioned at
+        its value, which must be consumed before asking for the next key
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.read_string()
+            self.expect(':')
+            yield key
+
+            c = self.peek()
+            self.pos += 1
+            if c == '}':
+                return
+            if c != ',':
+                self.pos -= 1
+                raise self.error("',' or '}'")
+
+    def iter_array(self):
+        """
+        Yield the index of each item in the next list, leaving the stream
+        positioned at the item, which must be consumed before the next one
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        i = 0
+        while True:
+            yield i
+            i += 1
+
+            c = self.peek()
+            self.pos += 1
+            if c == ']':
+                return
+            if c != ',':
+                self.pos -= 1
+                raise self.error("',' or ']'")
+
+
+class PathQuery(object):
+    """
+    A compiled path expression, which can be evaluated against a decoded
+    value or a JsonStream
+    """
+    ROOT = re.compile(r'\s*(?:(?:data|\$)(?![\w-]))?')
+    STEP = re.compile(r'''\s*(?:
+        \.?(?P<name>[A-Za-z_][\w-]*)
+        | (?P<wildcard>\.?\*|\[\s*\*\s*\])
+        | \[\s*(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")\s*\]
+        | \[\s*(?P<index>-?\d+)\s*\]
+        | \[\s*(?P<start>-?\d+)?\s*:\s*(?P<stop>-?\d+)?\s*
+            (?::\s*(?P<step>-?\d+)?\s*)?\]
+    )''', re.X)
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.steps = []
+
+        pos = self.ROOT.match(expression).end()
+        while pos < len(expression.rstrip()):
+            m = self.STEP.match(expression, pos)
+            if not m:
+                raise ValueError(
+                    'Invalid path at {!r}'.format(expression[pos:])
+                )
+
+            self.steps.append(self._compile_step(m))
+            pos = m.end()
+
+        # Whether the path can only ever match one value
+        self.singular = all(s[0] in (KEY, INDEX) for s in self.steps)
+
+    @staticmethod
+    def _compile_step(m):
+        if m.group('name'):
+            return KEY, m.group('name')
+        if m.group('wildcard'):
+            return WILDCARD, None
+        if m.group('string'):
+            try:
+                return KEY, ast.literal_eval(m.group('string'))
+            except (SyntaxError, ValueError) as e:
+                raise ValueError('Invalid path at {!r}: {}'.format(
+                    m.group(0), e.msg if isinstance(e, SyntaxError) else e
+                ))
+        if m.group('index'):
+            return INDEX, int(m.group('index'))
+
+        start, stop, step = (
+            int(m.group(g)) if m.group(g) else None
+            for g in ('start', 'stop', 'step')
+        )
+        if step == 0:
+            raise ValueError('Slice step cannot be zero')
+
+        return SLICE, slice(start, stop, step)
+
+    def evaluate(self, value):
+        """Yield each match in a decoded value"""
+        return self._evaluate_value(value, self.steps)
+
+    def _evaluate_value(self, value, steps):
+        if not steps:
+            yield value
+            return
+
+        (kind, arg), rest = steps[0], steps[1:]
+
+        if kind == KEY:
+            if isinstance(value, dict) and arg in value:
+                yield from self._evaluate_value(value[arg], rest)
+        elif kind == INDEX:
+            if isinstance(value, list) and -len(value) <= arg < len(value):
+                yield from self._evaluate_value(value[arg], rest)
+        elif kind == WILDCARD:
+            if isinstance(value, (dict, list)):
+                children = value.values() if isinstance(value, dict) else value
+                for child in children:
+                    yield from self._evaluate_value(child, rest)
+        elif kind == SLICE:
+            if isinstance(value, list):
+                for child in value[arg]:
+                    yield from self._evaluate_value(child, rest)
+
+    def stream(self, stream):
+        """
+        Yield each match while reading a JsonStream, stopping as soon as
+        there can't be any more
+        """
+        return self._evaluate_stream(stream, self.steps, True)
+
+    def _evaluate_stream(self, stream, steps, last):
+        """
+        :param last: Whether nothing after this value can match, so we can
+            stop reading as soon as we're done with it
+        """
+        if not steps:
+            yield stream.read_value()
+            return
+
+        (kind, arg), rest = steps[0], steps[1:]
+        c = stream.peek()
+
+        # These need to see the whole list
+        if kind == INDEX and arg < 0 or kind == SLICE and any(
+            i is not None and i < 0 for i in (arg.start, arg.stop, arg.step)
+        ):
+            yield from self._evaluate_value(stream.read_value(), steps)
+            return
+
+        if kind == KEY and c == '{':
+            found = False
+            for key in stream.iter_object():
+                if key == arg and not found:
+                    found = True
+                    yield from self._evaluate_stream(stream, rest, last)
+                    if last:
+                        return
+                else:
+                    stream.skip_value()
+
+        elif kind == INDEX and c == '[':
+            for i in stream.iter_array():
+                if i == arg:
+                    yield from self._evaluate_stream(stream, rest, last)
+                    if last:
+                        return
+                else:
+                    stream.skip_value()
+
+        elif kind == SLICE and c == '[':
+            start = arg.start or 0
+            step = arg.step or 1
+
+            for i in stream.iter_array():
+                if arg.stop is not None and i >= arg.stop:
+                    if last:
+                        return
+                    stream.skip_value()
+                elif i >= start and (i - start) % step == 0:
+                    yield from self._evaluate_stream(stream, rest, False)
+                else:
+                    stream.skip_value()
+
+        elif kind == WILDCARD and c == '{':
+            for _ in stream.iter_object():
+                yield from self._evaluate_stream(stream, rest, False)
+
+        elif kind == WILDCARD and c == '[':
+            for _ in stream.iter_array():
+                yield from self._evaluate_stream(stream, rest, False)
+
+        elif not last:
+            stream.skip_value()
+
 
 def pretty(data):
-    if type(data) == str or type(data) == unicode:
+    if type(data) == str:
         return data
 
+    # Indenting makes json use its much slower pure python encoder, and
+    # there's nothing to indent in other scalars
+    if not isinstance(data, (dict, list)):
+        return json.dumps(data)
+
     return json.dumps(data, indent=2, separators=(',', ': '))
 
 
-if __name__ == '__main__':
-    assert len(sys.argv) > 1
+def evaluate_lines(query, lines, first_line_num):
+    """
+    Apply a query to a batch of JSON lines
+
+    :returns: The formatted results, ready to write out
+    """
+    out = []
+
+    for line_num, line in enumerate(lines, first_line_num):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError('Line {}: {}'.format(line_num, e))
+
+        out.extend(pretty(result) + '\n' for result in query.evaluate(record))
+
+    return ''.join(out)
+
 
-    if sys.argv[1] == '--help':
-        print(__doc__)
-        sys.exit(0)
+def iter_batches(f):
+    """Batches of lines from f, each with the line number it starts at"""
+    line_num = 1
 
-    with open('/dev/stdin', 'rb') as f:
-        data = json.load(f)
-        exec('print(pretty({}))'.format(sys.argv[1]))
+    while True:
+        lines = list(itertools.islice(f, LINES_BATCH_SIZE))
+        if not lines:
+            return
+
+        yield lines, line_num
+        line_num += len(lines)
+
+
+# The query each worker process applies, compiled once per worker
+_worker_query = None
+
+
+def _init_worker(expression):
+    global _worker_query
+    _worker_query = PathQuery(expression)
+
+
+def _evaluate_batch(lines, first_line_num):
+    return evaluate_lines(_worker_query, lines, first_line_num)
+
+
+def run_lines(query, f, out, workers=1):
+    """
+    Apply a query to every record in a JSON lines file, writing results out
+    in the same order as the records, optionally over several processes
+    """
+    if workers <= 1:
+        for lines, line_num in iter_batches(f):
+            out.write(evaluate_lines(query, lines, line_num))
+        return
+
+    # Only read a few batches ahead of what's been written, so memory use
+    # doesn't depend on the size of the input
+    pending = collections.deque()
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        initargs=(query.expression,)
+    ) as pool:
+        for lines, line_num in iter_batches(f):
+            pending.append(pool.submit(_evaluate_batch, lines, line_num))
+
+            if len(pending) >= workers * 2:
+                out.write(pending.popleft().result())
+
+        while pending:
+            out.write(pending.popleft().result())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        'path', help="Path to the data to extract, eg. data['hodor']"
+    )
+    parser.add_argument(
+        '--lines', action='store_true',
+        help=(
+            'Read JSON lines, applying the path to every record. Records '
+            'with nothing at the path produce no output.'
+        )
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='With --lines, process records over this many processes'
+    )
+    args = parser.parse_args()
+
+    try:
+        query = PathQuery(args.path)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+
+    found = False
+    with open('/dev/stdin', 'r', encoding='utf-8') as f:
+        try:
+            if args.lines:
+                run_lines(query, f, sys.stdout, workers=args.workers)
+                return
+
+            for result in query.stream(JsonStream(f)):
+                found = True
+                print(pretty(result))
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+    if query.singular and not found:
+        print('Nothing found at {}'.format(query.expression), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,160 @@
 #!/usr/bin/env python3
 
 import calendar
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import os
 import sys
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+API_URL = 'https://api.pushover.net/1/messages.json'
+
+# Responses worth trying again; anything else is our fault and won't change
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def never_sent(error):
+    """
+    Whether a request failed before it reached pushover, so it's safe to
+    retry. Once it's been sent, pushover may have accepted it even if we
+    never saw the response, and retrying could deliver it twice.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+
+    # Connection refused, DNS failures and the like
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
 
 
 class NotificationPusher(object):
-    def __init__(self, api_key, user_key, api_url):
+    def __init__(self, api_key, user_key, api_url=API_URL, timeout=10,
+                 retries=3, backoff=5.0, workers=4):
+        """
+        :param timeout: Seconds to wait for pushover on each attempt
+        :param retries: Attempts to make after the first fails transiently
+        :param backoff: Seconds to wait before the first retry, doubling for
+            each retry after it, unless pushover asks for longer
+        :param workers: Messages to send concurrently with submit/send_many
+        """
         self.api_key = api_key
         self.user_key = user_key
         self.api_url = api_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = workers
+
+        # Reuse connections, so a batch of messages pays for one handshake
+        # per worker rather than one per message
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Wait for any queued messages to be sent, and release connections"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+    def _retry_delay(self, attempt, resp=None):
+        delay = self.backoff * 2 ** attempt
+
+        try:
+            return max(delay, float(resp.headers['Retry-After']))
+        except (AttributeError, KeyError, ValueError):
+            return delay
 
     def send_message(self, title, message, timestamp=None, priority=0):
         data = {
-            'token': API_KEY,
-            'user': USER_KEY,
+            'token': self.api_key,
+            'user': self.user_key,
             'title': title,
             'message': message,
             'timestamp': timestamp,
             'priority': priority
         }
 
-        resp = requests.post(API_URL, data=data)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
 
-        status = resp.status_code
-        if status < 200 or status > 299:
-            print('FAILURE: ', status, resp.json())
-            return False
+            try:
+                resp = self.session.post(
+                    self.api_url, data=data, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt or not never_sent(e):
+                    print('FAILURE: ', e)
+                    return False
+                time.sleep(self._retry_delay(attempt))
+                continue
 
-        return True
+            status = resp.status_code
+            if 200 <= status <= 299:
+                return True
+
+            if status not in RETRY_STATUSES or last_attempt:
+                try:
+                    body = resp.json()
+                except ValueError:
+                    body = resp.text
+                print('FAILURE: ', status, body)
+                return False
+
+            time.sleep(self._retry_delay(attempt, resp))
+
+    def submit(self, title, message, timestamp=None, priority=0):
+        """
+        Queue a message to be sent in the background
+
+        :returns: A Future which resolves to send_message's result
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='pushover'
+            )
+
+        return self._executor.submit(
+            self.send_message, title, message, timestamp, priority
+        )
+
+    def send_many(self, messages):
+        """
+        Send a batch of messages concurrently
+
+        :param messages: Tuples of send_message arguments, or dicts of its
+            keyword arguments
+        :returns: Whether each message was sent, in the same order
+        """
+        futures = [
+            self.submit(**m) if isinstance(m, dict) else self.submit(*m)
+            for m in messages
+        ]
+        return [f.result() for f in futures]
 
 
 if __name__ == '__main__':
     API_KEY = os.environ['PUSHOVER_TOKEN']
     USER_KEY = os.environ['PUSHOVER_USER']
-    API_URL = 'https://api.pushover.net/1/messages.json'
-
-    pusher = NotificationPusher(API_KEY, USER_KEY, API_URL)
-    success = pusher.send_message(
-        sys.argv[1],
-        sys.argv[2],
-        calendar.timegm(datetime.datetime.now().utctimetuple())
-    )
+
+    with NotificationPusher(API_KEY, USER_KEY, API_URL) as pusher:
+        success = pusher.send_message(
+            sys.argv[1],
+            sys.argv[2],
+            calendar.timegm(datetime.datetime.now().utctimetuple())
+        )
     sys.exit(0 if success else 1)
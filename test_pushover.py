@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for pushover.py, against a stub HTTP server on localhost. The title of
+each message tells the stub how to respond.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs
+
+from pushover import NotificationPusher
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        query = parse_qs(self.rfile.read(length).decode())
+        data = {k: v[0] for k, v in query.items()}
+        title = data['title']
+
+        with self.server.lock:
+            self.server.requests.append(data)
+            attempt = sum(
+                1 for r in self.server.requests if r['title'] == title
+            )
+
+        if title == 'abort':
+            # Hang up without a response, after the request has arrived
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+
+        if title == 'slow':
+            time.sleep(0.5)
+
+        headers = {}
+        if title == 'bad':
+            status = 400
+        elif title == 'limited' and attempt == 1:
+            status = 429
+            headers['Retry-After'] = '0'
+        elif title == 'flaky' and attempt == 1:
+            status = 503
+        else:
+            status = 200
+
+        body = b'{"status":1}'
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NotificationPusherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.connections = 0
+
+        threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        self.pusher = NotificationPusher(
+            'app-key', 'user-key', url, timeout=0.2, backoff=0.01, workers=2
+        )
+        self.addCleanup(self.pusher.close)
+
+        # Keep failure output out of the test run
+        patcher = mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def titles(self):
+        return [r['title'] for r in self.server.requests]
+
+    def test_send_message(self):
+        self.assertTrue(self.pusher.send_message('hello', 'world', 123))
+
+        [request] = self.server.requests
+        self.assertEqual(request['token'], 'app-key')
+        self.assertEqual(request['user'], 'user-key')
+        self.assertEqual(request['message'], 'world')
+        self.assertEqual(request['timestamp'], '123')
+
+    def test_rate_limited_is_retried(self):
+        self.assertTrue(self.pusher.send_message('limited', 'm'))
+        self.assertEqual(self.titles(), ['limited', 'limited'])
+
+    def test_server_error_is_retried(self):
+        self.assertTrue(self.pusher.send_message('flaky', 'm'))
+        self.assertEqual(self.titles(), ['flaky', 'flaky'])
+
+    def test_client_error_is_not_retried(self):
+        self.assertFalse(self.pusher.send_message('bad', 'm'))
+        self.assertEqual(self.titles(), ['bad'])
+
+    def test_read_timeout_is_not_retried(self):
+        # Pushover may have accepted the message, so a retry could send it
+        # twice
+        self.assertFalse(self.pusher.send_message('slow', 'm'))
+        self.assertEqual(self.titles(), ['slow'])
+
+    def test_aborted_connection_is_not_retried(self):
+        self.assertFalse(self.pusher.send_message('abort', 'm'))
+        self.assertEqual(self.titles(), ['abort'])
+
+    def test_refused_connection_is_retried(self):
+        # Grab a port nothing is listening on
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        pusher = NotificationPusher(
+            'app-key', 'user-key', 'http://127.0.0.1:{}/'.format(port),
+            retries=2, backoff=0.01
+        )
+        with pusher, mock.patch('pushover.time.sleep') as sleep:
+            self.assertFalse(pusher.send_message('hello', 'world'))
+
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_send_many(self):
+        messages = [('t{}'.format(i), 'm') for i in range(20)]
+        messages.append({'title': 'bad', 'message': 'm'})
+
+        results = self.pusher.send_many(messages)
+
+        self.assertEqual(results, [True] * 20 + [False])
+        self.assertEqual(len(self.server.requests), 21)
+
+        # Connections are pooled, one per worker
+        self.assertLessEqual(self.server.connections, 2)
+
+    def test_submit(self):
+        future = self.pusher.submit('hello', 'world')
+        self.assertTrue(future.result())
+
+
+if __name__ == '__main__':
+    unittest.main()